@@ -1,5 +1,6 @@
 """constants for AMY generation"""
 # imports
+import numpy as np
 
 # Constants
 ## Default Values
@@ -35,6 +36,14 @@ land_use_categories = {
     20 : {"description" : "Barren Tundra", "albedo" : 0.18},
     21 : {"description" : "Lakes", "albedo" : 0.08},
 }
+# land use table as arrays indexed by category number. NaN albedo and an empty
+# description for unused categories
+_albedo_lut = np.full(max(land_use_categories) + 1, np.nan)
+_land_use_descriptions = [""] * (max(land_use_categories) + 1)
+for _category, _properties in land_use_categories.items():
+    _albedo_lut[_category] = _properties["albedo"]
+    _land_use_descriptions[_category] = _properties["description"]
+_land_use_descriptions = tuple(_land_use_descriptions)
 
 variable_properties = {
     # variable name: {min, max, default_value, grib_byte_range, grib_location_indices}
@@ -75,7 +84,9 @@ variable_properties = {
     "liquid precipitation quantity [hr]": {"units":"hours", "position":34, "missing":99, "ep_used" : False}
 }
 
-_body_column_order = [] # TODO sort with "position" in variable_properties values
+# AMY body columns in file order, and the columns used by energy plus
+_body_column_order = tuple(name for name, _ in sorted(variable_properties.items(), key=lambda kv: kv[1]["position"]))
+_ep_used_columns = tuple(name for name in _body_column_order if variable_properties[name]["ep_used"])
 _grib_variables_preprocessing = {
     # variable name: {search_string, byte_start, byte_end, location_indices}
     # LAND USE TYPE FOR ALBEDO
@@ -122,6 +133,10 @@ _grib_variables_1h = {
     "categorical freezing rain" : {"searchstring" : ":CFRZR:", "variable_name" : "cfrzr"},  # [0,1]
 }
 
+# herbie search strings of the analysis (0h) and forecast (1h) variables
+_search_strings_0h = tuple(i["searchstring"] for i in _grib_variables_0h.values())
+_search_strings_1h = tuple(i["searchstring"] for i in _grib_variables_1h.values())
+
 _grib_variable_groups_0h = [
     ["total sky cover"],
     ["aerosol optical depth", "precipitable water", "vertically integrated smoke"],
@@ -148,3 +163,10 @@ _primary_variables = ["dry bulb temperature", "dew point temperature", "relative
     "precipitable water", "aerosol optical depth", "snow depth", "liquid precipitation depth"]  
 _secondary_variables = ["global horizontal radiation", "global horizontal illuminance", "horizontal infrared radiation intensity"]
 _post_process_variables = ["global horizontal illuminance", "direct normal illuminance", "diffuse horizontal illuminance", "zenith luminance", "days since last snowfall", "albedo", "liquid precipitation quantity"]
+
+## Cache store
+# columns of the cached analysis data, in the order they are stored on disk
+_cache_columns = tuple(
+    i.get("variable_name")
+    for i in (_grib_variables_0h | _grib_variables_1h).values()
+)
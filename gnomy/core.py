@@ -6,7 +6,9 @@
 
 # imports
 ## standard library
+from concurrent.futures import ThreadPoolExecutor
 import datetime
+import json
 import logging
 import os
 from typing import Union, Dict, List
@@ -41,27 +43,24 @@ class AMY:
         longitude : float
             longitude of the location. HRRR uses longitude of the form (0-360) where
             0 is th eprime meridian and then works eastward. Must be (225.9 - 299) E.
-            Inputs must be in range (225.9 - 229) or (-134.1 - -61)
+            Inputs must be in range (225.9 - 299) or (-134.1 - -61)
         """
+        # transform longitude to (0-360) before validating so one range check covers
+        # both input forms
+        longitude = longitude % 360
+
         # validate inputs
         assert (
             21.14 <= latitude <= 52.6
         ), "latitude must be between 21.14 N and 52.6 N for HRRR"
-        assert (225.9 <= longitude <= 299) or (
-            -134.1 <= longitude <= -61
+        assert (
+            225.9 <= longitude <= 299
         ), "longitude must be between (225.9 - 299) or (-134.1 - -61) for HRRR"
 
-        # transform longitude if neccessary
-        if longitude < 0:
-            longitude = 360 + longitude
-
         # general parameters
         self.latitude = latitude
         self.longitude = longitude
-        if name is not None:
-            self.name = name
-        else:
-            self.name = f"{self.latitude:.2f} N {self.longitude:.2f} E"
+        self.name = name if name is not None else f"{latitude:.2f} N {longitude:.2f} E"
         return
 
     def create_amy(
@@ -74,6 +73,10 @@ class AMY:
         rm_cache: bool = False,
         amy_target_path: str = None,
         verbose: int = 0,
+        batch_download: bool = False,
+        async_download: bool = False,
+        download_concurrency: int = 128,
+        kerchunk_download: bool = False,
     ):
         """create amy datafile
         1. preprocess
@@ -105,6 +108,18 @@ class AMY:
             0: no output
             1: only errors
             2: errors, progress
+        batch_download : bool
+            download all uncached hours first and read them together with
+            xarray.open_mfdataset (requires dask). Default is False.
+        async_download : bool
+            prefetch the GRIB subsets with concurrent HTTP range requests from an
+            asyncio event loop (requires aiohttp). Default is False.
+        download_concurrency : int
+            maximum number of range requests in flight when async_download is
+            used. Default is 128.
+        kerchunk_download : bool
+            index the remote GRIB files once with kerchunk and read all uncached
+            hours as one virtual Zarr store (requires kerchunk). Default is False.
 
         RETURNS
         ----------
@@ -119,8 +134,12 @@ class AMY:
         elif year is not None:
             assert start_date is None, "cannot provide both year and start_date"
             assert end_date is None, "cannot provide both year and end_date"
-            self.start_date = datetime.datetime(year, 1, 1)
-            self.end_date = datetime.datetime(year, 12, 31)
+            start_date = datetime.datetime(year, 1, 1)
+            end_date = datetime.datetime(year, 12, 31)
+        start_date = pd.Timestamp(start_date)
+        end_date = pd.Timestamp(end_date)
+        self.start_date = start_date
+        self.end_date = end_date
         assert (
             start_date.year >= constants.HRRR_first_year
         ), f"First year of HRRR data is {constants.HRRR_first_year}"
@@ -129,24 +148,67 @@ class AMY:
         # preprocess
         self.preprocess(cache_dir, start_date, end_date, self.latitude, self.longitude)
 
-        # download and cache analysis data
-        while self.uncached_dates:
-            utils.get_grib_data(
-                self.uncached_dates,
-                self.latitude,
-                self.longitude,
-                self.search_string_0h,
-                self.search_string_1h,
-                n_workers,
-                self.site_cache_dir,
-            )
-            
-            self.uncached_dates = self._identify_uncached_dates(cache_dir, start_date, end_date, freq="1H")
+        # download and cache analysis data. Reruns with a complete cache go straight
+        # to postprocessing
+        if not self.uncached_dates:
+            logger.info("all dates cached")
+        else:
+            logger.info(f"{len(self.uncached_dates)} uncached dates to download")
+        # the solar zenith angles only depend on the period and location. They are
+        # computed in the background while downloading and memoized for
+        # postprocessing
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            zenith_future = None
+            if self.uncached_dates:
+                zenith_future = executor.submit(
+                    utils.calculate_solar_zenith_angle,
+                    pd.date_range(start_date, end_date, freq="1H"),
+                    self.latitude,
+                    self.longitude,
+                )
+            while self.uncached_dates:
+                if kerchunk_download:
+                    utils.get_grib_data_kerchunk(
+                        self.uncached_dates,
+                        self.latitude,
+                        self.longitude,
+                        self.search_string_0h,
+                        self.search_string_1h,
+                        n_workers,
+                        self.site_cache_dir,
+                    )
+                elif async_download:
+                    utils.async_get_grib_data(
+                        self.uncached_dates,
+                        self.latitude,
+                        self.longitude,
+                        self.search_string_0h,
+                        self.search_string_1h,
+                        download_concurrency,
+                        self.site_cache_dir,
+                        n_jobs=n_workers,
+                    )
+                else:
+                    utils.get_grib_data(
+                        self.uncached_dates,
+                        self.latitude,
+                        self.longitude,
+                        self.search_string_0h,
+                        self.search_string_1h,
+                        n_workers,
+                        self.site_cache_dir,
+                        batch=batch_download,
+                    )
+
+                self.uncached_dates = self._identify_uncached_dates(self.site_cache_dir, start_date, end_date, freq="1H")
+            # raise errors of the background calculation here rather than silently
+            # computing the zenith angles again in postprocessing
+            if zenith_future is not None:
+                zenith_future.result()
 
         # postprocess
         self.post_process_cached_data(
-            self,
-            cache_dir,
+            self.site_cache_dir,
             amy_target_path,
             self.start_date,
             self.end_date,
@@ -159,23 +221,50 @@ class AMY:
     def preprocess(self, cache_dir, start_date, end_date, latitude, longitude, freq="1H"):
         """Prepare for AMY Generation and  initialize data structures
         1. create site cache directory
-        2. identify uncached dates
-        3. create search strings
-        4. estimate coordinate projection components
+        2. import legacy per-hour CSV cache files into the cache store
+        3. identify uncached dates
+        4. create search strings
+        5. estimate coordinate projection components and albedo of the site
         """
         self.site_cache_dir = self._prep_chache_dir(cache_dir)
-        self.uncached_dates = self._identify_uncached_dates(cache_dir, start_date, end_date, freq="1H")
-        self.search_string_0h = utils.get_search_string(
-            [i.get("searchstring") for i in constants._grib_variables_0h.values()]
-        )
-        self.search_string_1h = utils.get_search_string(
-            [i.get("searchstring") for i in constants._grib_variables_1h.values()]
-        )
-        self.uc, self.vc = utils.get_coordinate_projections(
-            start_date, latitude, longitude
+        utils.import_legacy_cache_files(self.site_cache_dir)
+        self.uncached_dates = self._identify_uncached_dates(self.site_cache_dir, start_date, end_date, freq="1H")
+        self.search_string_0h = utils.get_search_string(constants._search_strings_0h)
+        self.search_string_1h = utils.get_search_string(constants._search_strings_1h)
+        self.uc, self.vc, self.albedo = self._get_site_constants(
+            self.site_cache_dir, latitude, longitude
         )
         return
 
+    def _get_site_constants(self, site_cache_dir, latitude, longitude):
+        """coordinate projections and albedo of the site. They only depend on the
+        location, so they are saved in the site cache directory and reruns do not
+        need the HRRR grid"""
+        site_path = os.path.join(site_cache_dir, "site.json")
+        try:
+            with open(site_path) as f:
+                site = json.load(f)
+            if site["latitude"] == latitude and site["longitude"] == longitude:
+                return tuple(site["uc"]), tuple(site["vc"]), site["albedo"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.debug(f"site constants not cached: {e}")
+        uc, vc = utils.get_coordinate_projections(latitude, longitude)
+        uc = tuple(float(i) for i in uc)
+        vc = tuple(float(i) for i in vc)
+        albedo = utils.get_albedo(latitude, longitude)
+        with open(site_path, "w") as f:
+            json.dump(
+                {
+                    "latitude": latitude,
+                    "longitude": longitude,
+                    "uc": uc,
+                    "vc": vc,
+                    "albedo": albedo,
+                },
+                f,
+            )
+        return uc, vc, albedo
+
     def _prep_chache_dir(self, cache_dir):
         """create cache directory and subdirectory for site"""
         os.makedirs(cache_dir, exist_ok=True)
@@ -184,16 +273,12 @@ class AMY:
         return site_cache_dir
 
     def _identify_uncached_dates(self, specified_dir, start_date, end_date, freq="1H"):
-        """identify dates that are not cached in the site cache directory.
-        cache files are saved as "%Y%m%d%H%M.csv"""
+        """identify dates that are not cached in the site cache store.
+        see utils.open_cache_store for the layout of the store"""
         all_dates = pd.date_range(start_date, end_date, freq=freq)
-        uncached_dates = [
-            i
-            for i in all_dates
-            if not os.path.exists(
-                os.path.join(specified_dir, i.strftime("%Y%m%d%H%M.csv"))
-            )
-        ]
+        cached_dates = utils.get_cached_dates(specified_dir, start_date, end_date, freq=freq)
+        # ascending, so consecutive downloads hit the same day's files
+        uncached_dates = sorted(all_dates.difference(cached_dates))
         return uncached_dates
 
     def post_process_cached_data(
@@ -209,8 +294,8 @@ class AMY:
         # combine all cache files into one df
         cache_df = utils.combine_cache_files(cache_dir, start_date, end_date, freq=freq)
         # perform intermediate calculations and format data
-        intermediate_df = self._intermediate_calculations(cache_df, latitude, longitude)
-        amy_df = self._amy_data_df(intermediate_df)
+        index, data = self._intermediate_calculations(cache_df, latitude, longitude)
+        amy_df = self._amy_data_df(index, data)
         # create header
         header_lines = create_header(self.start_date, self.end_date)
         # export data
@@ -223,150 +308,108 @@ class AMY:
         return
 
     def _intermediate_calculations(self, cache_df, latitude, longitude):
-        intermediate_df = cache_df.copy()
-        # calculate solar position
-        intermediate_df["zenith"] = utils.calculate_solar_zenith_angle(
-            intermediate_df.index, latitude, longitude
-        )
-        intermediate_df["opaque_sky_cover"] = utils.cloud_cover_to_opaque_sky_cover(
-            intermediate_df["lcc"].values,
-            intermediate_df["mcc"].values,
-            intermediate_df["hcc"].values,
-            intermediate_df["tcc"].values,
-        )
-        intermediate_df[
-            "extraterrestrial_normal_radiation"
-        ] = utils.calculate_extraterrestrial_normal_radiation(
-            intermediate_df.index.dayofyear
-        )
-        intermediate_df[
-            "extraterrestrial_horizontal_irradiance"
-        ] = utils.calculate_extraterrestrial_horizontal_irradiance(
-            intermediate_df["zenith"].values,
-            intermediate_df["extraterrestrial_normal_radiation"].values,
-        )
-        intermediate_df["horizontal_ir"] = utils.horizontal_ir(
-            intermediate_df["t2m"].values,
-            intermediate_df["d2m"].values,
-            intermediate_df["opaque_sky_cover"].values,
-        )
-        intermediate_df["ghi"] = (
-            intermediate_df["vbdsf"].values
-            * np.cos(np.deg2rad(intermediate_df["zenith"]))
-            + intermediate_df["vddsf"].values
-        )
-        intermediate_df["global illuminance"] = utils.solar_irradiance_to_lux(
-            intermediate_df["ghi"].values
-        )
-        intermediate_df["normal illuminance"] = utils.solar_irradiance_to_lux(
-            intermediate_df["vbdsf"].values
-        )
-        intermediate_df["horizontal illuminance"] = utils.solar_irradiance_to_lux(
-            intermediate_df["vddsf"].values
+        """Derived quantities of the cached analysis data
+
+        RETURNS
+        ----------
+        index : pd.DatetimeIndex
+            timestamps of the rows
+        data : dict
+            column name: np.ndarray of the cached and derived quantities
+        """
+        # the cached columns are taken from the frame's single block at once, one
+        # contiguous array per column
+        index = cache_df.index
+        data = dict(
+            zip(cache_df.columns, np.ascontiguousarray(cache_df.to_numpy().T))
         )
-        intermediate_df["zenith illuminance"] = utils.solar_irradiance_to_lux(
-            intermediate_df["vbdsf"].values
-            * np.cos(np.deg2rad(intermediate_df["zenith"].values))
+        # calculate solar position
+        data["zenith"] = utils.calculate_solar_zenith_angle(
+            index, latitude, longitude
+        ).to_numpy()
+        solar_geometry = utils.SolarGeometry.from_zenith(
+            data["zenith"], index.dayofyear.values
         )
-        wind_e, wind_n = utils.convert_uv_projection_to_en(
-            intermediate_df["u10"].values,
-            intermediate_df["v10"].values,
+        data["extraterrestrial_normal_radiation"] = solar_geometry.g_normal
+        data |= utils.calculate_derived_quantities(
+            data["t2m"],
+            data["d2m"],
+            data["lcc"],
+            data["mcc"],
+            data["hcc"],
+            data["tcc"],
+            data["vbdsf"],
+            data["vddsf"],
+            data["u10"],
+            data["v10"],
+            solar_geometry,
             self.uc,
             self.vc,
         )
-        intermediate_df["wind_E"] = wind_e
-        intermediate_df["wind_N"] = wind_n
-        intermediate_df["wind direction"] = utils.get_wind_direction(wind_e, wind_n)
-        intermediate_df["wind speed"] = utils.get_wind_speed(wind_e, wind_n)
-        intermediate_df["aod"] = intermediate_df["unknown"]
-        intermediate_df["albedo"] = utils.get_albedo(latitude, longitude)
-        # days since last snowfall
-        intermediate_df["snow_day"] = (
-            intermediate_df.groupby(intermediate_df.index.date)["csnow"].transform(
-                "sum"
-            )
-            > 0
+        data["aod"] = data["unknown"]
+        data["albedo"] = self.albedo
+        data["Days Since Last Snowfall [Days]"] = utils.days_since_last_snowfall(
+            index, data["csnow"]
         )
-        snow_days = intermediate_df[intermediate_df["snow_day"]].copy()
-        snow_days["last_snow_day"] = snow_days.index
-        intermediate_df = pd.merge_asof(
-            intermediate_df,
-            snow_days["last_snow_day"],
-            left_index=True,
-            right_index=True,
-            direction="backward",
-        )
-
-        intermediate_df["Days Since Last Snowfall [Days]"] = (
-            intermediate_df.index - intermediate_df["last_snow_day"]
-        ).dt.days
-        intermediate_df["Days Since Last Snowfall [Days]"].clip(0, 99)
-        return intermediate_df
-
-    def _amy_data_df(self, df):
-        amy_df = pd.DataFrame(index=df.index)
-        amy_df["year"] = df.index.year
-        amy_df["month"] = df.index.month
-        amy_df["day"] = df.index.day
-        amy_df["hour"] = df.index.hour
-        amy_df["minute"] = df.index.minute
-        amy_df["data_flags"] = "NOAA HRRR"
-        amy_df["dry bulb temperature [C]"] = df["t2m"].values - 273.15
-        amy_df["dew point temperature [C]"] = df["d2m"].values - 273.15
-        amy_df["relative humidity [%]"] = df["r2"].values
-        amy_df["atmospheric station pressure [Pa]"] = df["sp"].values
-        amy_df["extraterrestrial horizontal radiation [Wh/m^2]"] = df[
-            "extraterrestrial_horizontal_irradiance"
-        ].values
-        amy_df["extraterrestrial direct normal radiation [Wh/m^2]"] = df[
-            "extraterrestrial_normal_radiation"
-        ].values
-        amy_df["horizontal infrared radiation intensity [Wh/m^2]"] = df[
-            "horizontal_ir"
-        ].values
-        amy_df["global horizontal radiation [Wh/m^2]"] = df["ghi"].values
-        amy_df["direct normal radiation [Wh/m^2]"] = df["vddsf"].values
-        amy_df["diffuse horizontal radiation [Wh/m^2]"] = df["vbdsf"].values
-        amy_df["global horizontal illuminance [lux]"] = df["global illuminance"].values
-        amy_df["direct normal illuminance [lux]"] = df["normal illuminance"].values
-        amy_df["diffuse horizontal illuminance [lux]"] = df[
-            "horizontal illuminance"
-        ].values
-        amy_df["zenith luminance [cd/m^2]"] = df["zenith illuminance"].values
-        amy_df["wind direction [deg]"] = df["wind direction"].values
-        amy_df["wind speed [m/s]"] = df["wind speed"].values
-        amy_df["total sky cover [tenths]"] = df["tcc"].values / 10
-        amy_df["opaque sky cover [tenths]"] = df["opaque_sky_cover"]
-        amy_df["visibility [km]"] = df["vis"].values / 1000
-        amy_df["ceiling height [m]"] = df["gh"].values
-        amy_df["present weather observation"] = 0  ##########
-        amy_df["present weather codes"] = df.apply(
-            lambda x: utils.parse_weather_code(
-                accumulated_precipitation=x["tp"],
-                freezing_rain=x["cfrzr"],
-                ice_pellets=x["cicep"],
-                lightning=x["ltng"],
-                rain=x["crain"],
-                snow=x["csnow"],
-                pct_frozen_precipitation=x["cpofp"],
-                visibility=x["vis"],
-                wind_gust_speed=x["gust"],
-                smoke=x["tc_mdens"],
+        return index, data
+
+    def _amy_data_df(self, index, data):
+        columns = {
+            "year": index.year,
+            "month": index.month,
+            "day": index.day,
+            "hour": index.hour,
+            "minute": index.minute,
+            "data_flags": "NOAA HRRR",
+            "dry bulb temperature [C]": data["t2m"] - 273.15,
+            "dew point temperature [C]": data["d2m"] - 273.15,
+            "relative humidity [%]": data["r2"],
+            "atmospheric station pressure [Pa]": data["sp"],
+            "extraterrestrial horizontal radiation [Wh/m^2]": data[
+                "extraterrestrial_horizontal_irradiance"
+            ],
+            "extraterrestrial direct normal radiation [Wh/m^2]": data[
+                "extraterrestrial_normal_radiation"
+            ],
+            "horizontal infrared radiation intensity [Wh/m^2]": data["horizontal_ir"],
+            "global horizontal radiation [Wh/m^2]": data["ghi"],
+            "direct normal radiation [Wh/m^2]": data["vddsf"],
+            "diffuse horizontal radiation [Wh/m^2]": data["vbdsf"],
+            "global horizontal illuminance [lux]": data["global illuminance"],
+            "direct normal illuminance [lux]": data["normal illuminance"],
+            "diffuse horizontal illuminance [lux]": data["horizontal illuminance"],
+            "zenith luminance [cd/m^2]": data["zenith illuminance"],
+            "wind direction [deg]": data["wind direction"],
+            "wind speed [m/s]": data["wind speed"],
+            "total sky cover [tenths]": data["tcc"] / 10,
+            "opaque sky cover [tenths]": data["opaque_sky_cover"],
+            "visibility [km]": data["vis"] / 1000,
+            "ceiling height [m]": data["gh"],
+            "present weather observation": 0,  ##########
+            "present weather codes": utils.parse_weather_code_vec(
+                accumulated_precipitation=data["tp"],
+                freezing_rain=data["cfrzr"],
+                ice_pellets=data["cicep"],
+                lightning=data["ltng"],
+                rain=data["crain"],
+                snow=data["csnow"],
+                pct_frozen_precipitation=data["cpofp"],
+                visibility=data["vis"],
+                wind_gust_speed=data["gust"],
+                smoke=data["tc_mdens"],
             ),
-            axis=1,
-        ).values
-        amy_df["precipitable water [mm]"] = df["pwat"].values
-        amy_df["aerosol optical depth [thousandths]"] = df["aod"].values
-        amy_df["snow depth [cm]"] = df["sde"].values * 100
-        amy_df["days since last snowfall"] = df[
-            "Days Since Last Snowfall [Days]"
-        ].values
-        amy_df["albedo [nondim]"] = df["albedo"]
-        amy_df["liquid precipitation depth [mm]"] = df["tp"].values
-        amy_df["liquid precipitation quantity [hr]"] = 1
-        # TODO: enforce column order
-
-        return amy_df
+            "precipitable water [mm]": data["pwat"],
+            "aerosol optical depth [thousandths]": data["aod"],
+            "snow depth [cm]": data["sde"] * 100,
+            "days since last snowfall": data["Days Since Last Snowfall [Days]"],
+            "albedo [nondim]": data["albedo"],
+            "liquid precipitation depth [mm]": data["tp"],
+            "liquid precipitation quantity [hr]": 1,
+        }
+        # one constructor call, in the column order of the AMY file
+        return pd.DataFrame(
+            columns, index=index, columns=constants._body_column_order, copy=False
+        )
 
 
 def create_header(
@@ -9,17 +9,52 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+import asyncio
+from concurrent.futures import as_completed, ThreadPoolExecutor
+from dataclasses import dataclass
 import datetime
-import glob
+import functools
+import json
+import math
 import os
+import shutil
+import subprocess
 import warnings
 
-from herbie import Herbie
-from joblib import delayed, Parallel
+from herbie import FastHerbie, Herbie
 import numpy as np
 import pandas as pd
 from pvlib import solarposition
-import pytz
+from scipy.spatial import cKDTree
+import xarray as xr
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+try:
+    import dask
+except ImportError:
+    dask = None
+try:
+    import fsspec
+    from kerchunk.combine import MultiZarrToZarr
+    from kerchunk.grib2 import scan_grib
+except ImportError:
+    fsspec = MultiZarrToZarr = scan_grib = None
+try:
+    import numba
+except ImportError:
+    numba = None
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as pa_ds
+except ImportError:
+    pa = pa_ds = None
 
 from . import constants
 
@@ -31,6 +66,43 @@ warnings.filterwarnings(
     "ignore",
     message="Calling float on a single element Series is deprecated and will raise a TypeError in the future. Use float(ser.iloc[0]) instead",
 )  # warning from Herbie. TODO: update Herbie to fix this
+warnings.filterwarnings(
+    "ignore", message="Will not remove GRIB file because it previously existed."
+)  # warning from Herbie when reading subset files prefetched by async_get_grib_data
+warnings.filterwarnings(
+    "ignore", message="Reloading spa to use numba"
+)  # warning from pvlib when switching to the numba SPA implementation
+
+## solar position method
+# the numba SPA is the same algorithm as the default but JIT-compiled. fall back
+# to the numpy implementation if numba is not available or the SPA does not compile
+@functools.lru_cache(maxsize=1)
+def _get_solar_position_method():
+    """pvlib solar position method, checked on the first solar position calculation
+    rather than at import so importing gnomy does not pay for the compilation"""
+    if numba is None:
+        return "nrel_numpy"
+    dummy_index = pd.date_range("2022-01-01", periods=2, freq="1h", tz="UTC")
+    try:
+        solarposition.get_solarposition(dummy_index, 30.0, -98.0, method="nrel_numba")
+    except Exception as e:
+        logger.debug(f"numba SPA unavailable, using nrel_numpy: {e}")
+        return "nrel_numpy"
+    return "nrel_numba"
+
+
+def _njit(*args, **kwargs):
+    """numba.njit if numba is installed, otherwise the function runs as python"""
+    if numba is None:
+        return lambda func: func
+    return numba.njit(*args, **kwargs)
+
+
+# parallel loop range inside _njit(parallel=True) functions
+_prange = range if numba is None else numba.prange
+# fast math flags for the kernels, without the no-nan/no-inf assumptions so
+# missing (NaN) analysis values propagate
+_fastmath = {"nsz", "arcp", "contract", "afn", "reassoc"}
 
 
 # functions
@@ -48,24 +120,53 @@ def get_search_string(list_of_searches):
     search_string : str
         search string for herbie
     """
-    mid_string = "|".join(list_of_searches)
-    return "(?:" + mid_string + ")"
+    return _get_search_string(tuple(list_of_searches))
+
+
+@functools.lru_cache(maxsize=128)
+def _get_search_string(searches):
+    """cached get_search_string for a tuple of search strings"""
+    return f"(?:{'|'.join(searches)})"
+
+
+def _nearest_and_extract(data_i, latitude, longitude):
+    """values of all variables of one dataset at the grid point nearest the location"""
+    logger.debug("----Locating nearest point")
+    argmin_y, argmin_x = _nearest_grid_index(latitude, longitude)
+    data_i = data_i.isel(y=argmin_y, x=argmin_x).drop_vars(
+        "gribfile_projection", errors="ignore"
+    )
+    if not data_i.data_vars:
+        return {}
+    logger.debug("--------Adding variable values at location")
+    values = data_i.to_array()
+    return dict(zip(values["variable"].values.tolist(), values.values.tolist()))
 
 
 def parse_xarray_data(xarray_data, latitude, longitude):
-    """ """
-    parsed_data = {}
+    """Extract the values at a location from the datasets returned by Herbie
+
+    Parameters
+    ----------
+    xarray_data : list of xarray.Dataset
+        datasets returned by Herbie.xarray
+    latitude : float
+        latitude of location
+    longitude : float
+        longitude of the location
 
+    Returns
+    ----------
+    parsed_data : dict
+        variable name: value at the location
+    """
+    if not isinstance(xarray_data, list):
+        xarray_data = [xarray_data]
+    # the hours are already read in parallel by get_grib_data, and each dataset is
+    # a single isel, so the datasets of an hour are read in a plain loop
+    parsed_data = {}
     for data_i in xarray_data:
-        logger.debug("----Individual dataset selected")
-        # data_i = data_i.drop_vars(["time", "step", "valid_time", "gribfile_projection"], errors="ignore")
-        data_i.drop_vars(["time", "step", "valid_time"], errors="ignore")
-        logger.debug("----Locating nearest point")
-        data_i = data_i.herbie.nearest_points((longitude, latitude))
-        for data_var in list(data_i.data_vars):
-            if data_var != "gribfile_projection":
-                logger.debug("--------Adding variable value at location")
-                parsed_data[data_var] = data_i[data_var].values[0]
+        parsed_data.update(_nearest_and_extract(data_i, latitude, longitude))
     return parsed_data
 
 
@@ -87,8 +188,8 @@ def get_grib_hour_data(
 
     RETURNS
     ----------
-    df : pandas.DataFrame
-        dataframe of the HRRR analysis data for the hour
+    analysis_data : dict
+        variable name: value of the HRRR analysis data for the hour
     """
     try:
         logger.debug("Creating Herbie Objects")
@@ -107,11 +208,10 @@ def get_grib_hour_data(
         H0_selected_data = parse_xarray_data(H0_data, latitude, longitude)
         H1_selected_data = parse_xarray_data(H1_data, latitude, longitude)
         analysis_data = H0_selected_data | H1_selected_data
-        logger.debug("Creating Dataframe")
-        df = pd.DataFrame(data=analysis_data, index=[grib_dt])
-        return df
+        return analysis_data
     except Exception as e:
-        print(e)
+        # None marks the hour as failed, it stays uncached and is downloaded again
+        logger.warning(f"failed to get HRRR data for {grib_dt}: {e}")
     return None
 
 
@@ -123,74 +223,995 @@ def get_grib_data(
     search_string_1h,
     n_jobs,
     cache_dir,
+    batch=False,
 ):
-    """Get grib data from HRRR analysis, save in cache dir
+    """Get grib data from HRRR analysis, save in the cache store of cache dir
 
     PARAMETERS
     ----------
     TODO
+    batch : bool
+        download all hours first and read them with one dataset per hypercube.
+        See get_grib_data_batch. Default is False, read each hour separately
 
     RETURNS
     ----------
     list of datetimes with errors
     """
+    if batch:
+        return get_grib_data_batch(
+            grib_datetimes,
+            latitude,
+            longitude,
+            search_string_0h,
+            search_string_1h,
+            n_jobs,
+            cache_dir,
+        )
+    # create the stores up front so workers only ever open them for writing
+    for year in sorted({i.year for i in grib_datetimes}):
+        open_cache_store(cache_dir, year)
 
     def grib_download_wrapper(grib_datetime):
         """wrapper for grib_download"""
-        save_path = os.path.join(cache_dir, grib_datetime.strftime("%Y%m%d%H%M%S.csv"))
-        df = get_grib_hour_data(
+        analysis_data = get_grib_hour_data(
             grib_datetime, search_string_0h, search_string_1h, latitude, longitude
         )
-        if df is not None:
-            df.to_csv(save_path)
+        if analysis_data is not None:
+            _write_cache_row(cache_dir, grib_datetime, analysis_data)
             return None
         else:
             return grib_datetime
 
-    # download data
+    # download data. downloads are network bound, so threads are used and there
+    # can be more of them than cores
+    max_workers = min(max(n_jobs, 1) * 4, 64)
+    failed_datetimes = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(grib_download_wrapper, i): i for i in grib_datetimes
+        }
+        for future in as_completed(futures):
+            try:
+                failed_datetime = future.result()
+            except Exception as e:
+                logger.debug(e)
+                failed_datetime = futures[future]
+            if failed_datetime is not None:
+                failed_datetimes.append(failed_datetime)
+
+    return sorted(failed_datetimes)
+
+
+async def _fetch_byte_range(session, semaphore, url, start_byte, end_byte):
+    """GET one byte range of a remote file. A missing end_byte reads to the end"""
+    end = "" if pd.isna(end_byte) else int(end_byte)
+    headers = {"Range": f"bytes={int(start_byte)}-{end}"}
+    async with semaphore:
+        async with session.get(url, headers=headers) as response:
+            response.raise_for_status()
+            if response.status != 206:
+                raise RuntimeError(f"Range request not honored by {url}")
+            return await response.read()
+
+
+async def _download_grib_subset(session, semaphore, H, search_string):
+    """Download the messages of Herbie object H matching search_string into Herbie's
+    local subset file. Runs of consecutive messages are fetched with one range
+    request each and all requests are in flight at once
+
+    RETURNS
+    ----------
+    True if the subset file exists afterwards or Herbie can subset a local file
+    """
+    local_path = H.get_localFilePath(search_string)
+    if local_path.exists():
+        return True
+    if H.grib is None:
+        return False
+    if not str(H.grib).startswith(("http://", "https://")):
+        return True  # full file is local, Herbie subsets it when reading
+    inventory = await asyncio.to_thread(H.inventory, search_string)
+    if len(inventory) == 0:
+        return False
+    download_groups = inventory["grib_message"].diff().ne(1).cumsum()
+    byte_ranges = inventory.groupby(download_groups).agg(
+        start_byte=("start_byte", "min"),
+        end_byte=("end_byte", lambda x: x.iloc[-1]),
+    )
+    chunks = await asyncio.gather(
+        *(
+            _fetch_byte_range(session, semaphore, str(H.grib), start, end)
+            for start, end in byte_ranges.itertuples(index=False)
+        )
+    )
+    # only write complete subsets so a failed hour is downloaded again
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(local_path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    return True
+
+
+async def _async_download_grib_data(
+    grib_datetimes, search_string_0h, search_string_1h, concurrency
+):
+    """download the subset files of all hours, returns the datetimes that failed"""
+    one_hour = datetime.timedelta(hours=1)
+    semaphore = asyncio.Semaphore(concurrency)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=30)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+
+        async def download_hour(grib_datetime):
+            # creating Herbie objects checks the remote sources, keep it off the loop
+            H0, H1 = await asyncio.gather(
+                asyncio.to_thread(
+                    Herbie,
+                    grib_datetime,
+                    model="hrrr",
+                    product="sfc",
+                    fxx=0,
+                    verbose=False,
+                ),
+                asyncio.to_thread(
+                    Herbie,
+                    grib_datetime - one_hour,
+                    model="hrrr",
+                    product="sfc",
+                    fxx=1,
+                    verbose=False,
+                ),
+            )
+            downloaded = await asyncio.gather(
+                _download_grib_subset(session, semaphore, H0, search_string_0h),
+                _download_grib_subset(session, semaphore, H1, search_string_1h),
+            )
+            return all(downloaded)
+
+        results = await asyncio.gather(
+            *(download_hour(i) for i in grib_datetimes), return_exceptions=True
+        )
+    failed_datetimes = []
+    for grib_datetime, result in zip(grib_datetimes, results):
+        if isinstance(result, Exception) or not result:
+            logger.debug(f"async download failed for {grib_datetime}: {result}")
+            failed_datetimes.append(grib_datetime)
+    return failed_datetimes
+
+
+def async_get_grib_data(
+    grib_datetimes,
+    latitude,
+    longitude,
+    search_string_0h,
+    search_string_1h,
+    concurrency,
+    cache_dir,
+    n_jobs=1,
+):
+    """Get grib data from HRRR analysis, save in the cache store of cache dir.
+    The subset GRIB files of all hours are first downloaded from an asyncio event
+    loop with up to `concurrency` HTTP range requests in flight, then read with
+    get_grib_data. Without aiohttp the downloads are left to get_grib_data
+
+    PARAMETERS
+    ----------
+    same as get_grib_data
+    concurrency : int
+        maximum number of range requests in flight, e.g. 64-256
+
+    RETURNS
+    ----------
+    list of datetimes with errors
+    """
+    if aiohttp is None:
+        logger.debug("aiohttp is not installed, downloading with threads")
+    else:
+        download = _async_download_grib_data(
+            list(grib_datetimes), search_string_0h, search_string_1h, concurrency
+        )
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(download)
+        else:
+            # already inside an event loop (e.g. jupyter), run in a separate thread
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(asyncio.run, download).result()
+    # hours that failed to prefetch are downloaded again by Herbie
+    return get_grib_data(
+        grib_datetimes,
+        latitude,
+        longitude,
+        search_string_0h,
+        search_string_1h,
+        n_jobs,
+        cache_dir,
+    )
+
+
+def _hypercube_filters(xarray_data):
+    """cfgrib filter_by_keys of each hypercube in the datasets returned by Herbie"""
+    filters = []
+    for data_i in xarray_data:
+        data_var = next(i for i in data_i.data_vars if i != "gribfile_projection")
+        attrs = data_i[data_var].attrs
+        type_of_level = attrs.get("GRIB_typeOfLevel")
+        filter_by_keys = {
+            "typeOfLevel": type_of_level,
+            "stepType": attrs.get("GRIB_stepType"),
+        }
+        if type_of_level in data_i.coords and data_i[type_of_level].size == 1:
+            filter_by_keys["level"] = data_i[type_of_level].item()
+        filters.append(filter_by_keys)
+    return filters
+
+
+def _read_grib_files_at_location(H, search_string, file_paths, latitude, longitude):
+    """Values at a location of every variable in GRIB files with the same messages
+    as the subset file of Herbie object H. Each hypercube is opened once across all
+    files with xarray.open_mfdataset, or concatenated from one dataset per file
+    without dask
+
+    RETURNS
+    ----------
+    dict of variable name: array of values in the order of file_paths
+    """
+    xarray_data = H.xarray(searchString=search_string)
+    if not isinstance(xarray_data, list):
+        xarray_data = [xarray_data]
+    argmin_y, argmin_x = _nearest_grid_index(latitude, longitude)
+    file_paths = [str(i) for i in file_paths]
+    values = {}
+    for filter_by_keys in _hypercube_filters(xarray_data):
+        open_kwargs = {
+            "engine": "cfgrib",
+            "backend_kwargs": {"indexpath": "", "filter_by_keys": filter_by_keys},
+        }
+        if dask is not None:
+            datasets = [
+                xr.open_mfdataset(
+                    file_paths,
+                    combine="nested",
+                    concat_dim="time",
+                    parallel=True,
+                    **open_kwargs,
+                )
+            ]
+            ds = datasets[0]
+        else:
+            # open_mfdataset always chunks with dask, open the files one by one
+            datasets = [xr.open_dataset(i, **open_kwargs) for i in file_paths]
+            ds = xr.combine_nested(datasets, concat_dim="time")
+        ds = ds.isel(y=argmin_y, x=argmin_x)
+        for data_var in ds.data_vars:
+            if data_var != "gribfile_projection":
+                values[data_var] = ds[data_var].values
+        for data_i in datasets:
+            data_i.close()
+    return values
+
+
+def _crop_grib_files(file_paths, latitude, longitude, out_path, margin=0.05):
+    """Crop GRIB files to a small box around a location and concatenate the
+    cropped messages into one file with wgrib2. wgrib2 decodes and re-packs the
+    messages in C, so only a few grid points per message are left for cfgrib"""
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    lon_box = f"{longitude - margin}:{longitude + margin}"
+    lat_box = f"{latitude - margin}:{latitude + margin}"
+    for file_path in file_paths:
+        subprocess.run(
+            [
+                "wgrib2",
+                str(file_path),
+                "-set_grib_type",
+                "c3",
+                "-append",
+                "-small_grib",
+                lon_box,
+                lat_box,
+                str(out_path),
+            ],
+            check=True,
+            capture_output=True,
+        )
+
+
+def _read_cropped_grib_at_location(
+    cropped_path, hypercube_filters, latitude, longitude
+):
+    """Values at a location of every hypercube of a cropped GRIB file
+
+    RETURNS
+    ----------
+    dict of variable name: pd.Series of values indexed by valid time
+    """
+    values = {}
+    for filter_by_keys in hypercube_filters:
+        ds = xr.open_dataset(
+            cropped_path,
+            engine="cfgrib",
+            backend_kwargs={"indexpath": "", "filter_by_keys": filter_by_keys},
+        )
+        # the cropped grid is a few points, nearest point by brute force
+        distance = (ds.latitude.values - latitude) ** 2 + (
+            ds.longitude.values - longitude % 360
+        ) ** 2
+        argmin_y, argmin_x = np.unravel_index(distance.argmin(), distance.shape)
+        ds = ds.isel(y=argmin_y, x=argmin_x)
+        valid_times = pd.DatetimeIndex(np.atleast_1d(ds["valid_time"].values).ravel())
+        for data_var in ds.data_vars:
+            if data_var != "gribfile_projection":
+                values[data_var] = pd.Series(
+                    np.atleast_1d(ds[data_var].values).ravel(), index=valid_times
+                )
+        ds.close()
+    return values
+
+
+def get_grib_data_batch(
+    grib_datetimes,
+    latitude,
+    longitude,
+    search_string_0h,
+    search_string_1h,
+    n_jobs,
+    cache_dir,
+):
+    """Get grib data of many hours at once, save in the cache store of cache dir.
+    The subset GRIB files of all hours are downloaded in parallel with FastHerbie,
+    then each hypercube is opened once for all hours so the values at the location
+    are read as whole timeseries. With dask the files are opened in parallel by
+    xarray.open_mfdataset. If wgrib2 is on the PATH the files are instead cropped
+    around the location and concatenated into one file per forecast hour with
+    wgrib2
+
+    PARAMETERS
+    ----------
+    same as get_grib_data
+
+    RETURNS
+    ----------
+    list of datetimes with errors
+    """
+    grib_datetimes = sorted(pd.Timestamp(i) for i in grib_datetimes)
+    max_threads = min(max(n_jobs, 1) * 4, 64)
+    one_hour = datetime.timedelta(hours=1)
+    FH0 = FastHerbie(
+        grib_datetimes, model="hrrr", product="sfc", fxx=[0], max_threads=max_threads
+    )
+    FH1 = FastHerbie(
+        [i - one_hour for i in grib_datetimes],
+        model="hrrr",
+        product="sfc",
+        fxx=[1],
+        max_threads=max_threads,
+    )
+    FH0.download(search_string_0h, max_threads=max_threads)
+    FH1.download(search_string_1h, max_threads=max_threads)
+
+    # hours with both subset files available
+    H0_by_date = {pd.Timestamp(H.date): H for H in FH0.file_exists}
+    H1_by_date = {pd.Timestamp(H.date) + one_hour: H for H in FH1.file_exists}
+    downloaded_datetimes, paths_0h, paths_1h = [], [], []
+    for grib_datetime in grib_datetimes:
+        if grib_datetime not in H0_by_date or grib_datetime not in H1_by_date:
+            continue
+        path_0h = H0_by_date[grib_datetime].get_localFilePath(search_string_0h)
+        path_1h = H1_by_date[grib_datetime].get_localFilePath(search_string_1h)
+        if os.path.exists(path_0h) and os.path.exists(path_1h):
+            downloaded_datetimes.append(grib_datetime)
+            paths_0h.append(path_0h)
+            paths_1h.append(path_1h)
+    if not downloaded_datetimes:
+        return grib_datetimes
+
+    if shutil.which("wgrib2") is not None:
+        try:
+            analysis_data = {}
+            for H, search_string, paths, fxx in (
+                (H0_by_date[downloaded_datetimes[0]], search_string_0h, paths_0h, 0),
+                (H1_by_date[downloaded_datetimes[0]], search_string_1h, paths_1h, 1),
+            ):
+                xarray_data = H.xarray(searchString=search_string)
+                if not isinstance(xarray_data, list):
+                    xarray_data = [xarray_data]
+                cropped_path = os.path.join(cache_dir, f"cropped_{fxx}h.grib2")
+                _crop_grib_files(paths, latitude, longitude, cropped_path)
+                cropped_values = _read_cropped_grib_at_location(
+                    cropped_path, _hypercube_filters(xarray_data), latitude, longitude
+                )
+                os.remove(cropped_path)
+                for variable, series in cropped_values.items():
+                    analysis_data[variable] = series.reindex(
+                        pd.DatetimeIndex(downloaded_datetimes)
+                    ).values
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.debug(e)
+            return grib_datetimes
+        _write_cache_rows(cache_dir, downloaded_datetimes, analysis_data)
+        downloaded = set(downloaded_datetimes)
+        return [i for i in grib_datetimes if i not in downloaded]
+
     try:
-        out = Parallel(n_jobs=n_jobs)(
-            delayed(grib_download_wrapper)(i) for i in grib_datetimes
+        analysis_data = _read_grib_files_at_location(
+            H0_by_date[downloaded_datetimes[0]],
+            search_string_0h,
+            paths_0h,
+            latitude,
+            longitude,
+        ) | _read_grib_files_at_location(
+            H1_by_date[downloaded_datetimes[0]],
+            search_string_1h,
+            paths_1h,
+            latitude,
+            longitude,
         )
     except Exception as e:
-        logging.debug(e)
+        logger.debug(e)
+        return grib_datetimes
+    _write_cache_rows(cache_dir, downloaded_datetimes, analysis_data)
 
-    return [i for i in out if i is not None]
+    downloaded = set(downloaded_datetimes)
+    return [i for i in grib_datetimes if i not in downloaded]
 
 
-def combine_cache_files(cache_dir, start_date, end_date, freq):
+def _drop_reference_time(refs):
+    """drop the reference time of a message so only valid_time is concatenated"""
+    return {k: v for k, v in refs.items() if not k.startswith("time/")}
+
+
+def build_kerchunk_refs(
+    grib_urls, filter_by_keys, n_jobs=1, remote_protocol="https"
+):
+    """Kerchunk references of one hypercube of many remote GRIB files, combined
+    along valid_time into a single virtual Zarr store. The files are scanned once
+    and no GRIB data is downloaded
+
+    PARAMETERS
+    ----------
+    grib_urls : list of str
+        http(s) urls of the GRIB files
+    filter_by_keys : dict
+        GRIB keys of the messages to keep, see kerchunk.grib2.scan_grib. Must give
+        the typeOfLevel of the hypercube
+    n_jobs : int
+        the files are scanned in parallel threads, 4 per job
+    remote_protocol : str
+        fsspec protocol of grib_urls. Default is "https"
+
+    RETURNS
+    ----------
+    refs : dict
+        combined kerchunk references
+    """
+    max_workers = min(max(n_jobs, 1) * 4, 64)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        scanned = executor.map(
+            lambda url: scan_grib(url, filter=filter_by_keys), grib_urls
+        )
+        message_refs = [refs for file_refs in scanned for refs in file_refs]
+    return MultiZarrToZarr(
+        message_refs,
+        concat_dims=["valid_time"],
+        identical_dims=[
+            "latitude",
+            "longitude",
+            "step",
+            filter_by_keys["typeOfLevel"],
+        ],
+        remote_protocol=remote_protocol,
+        preprocess=_drop_reference_time,
+    ).translate()
+
+
+def _read_kerchunk_refs_at_location(
+    refs, latitude, longitude, remote_protocol="https"
+):
+    """valid times and values at a location of the variables of a kerchunk store"""
+    mapper = fsspec.get_mapper(
+        "reference://", fo=refs, remote_protocol=remote_protocol
+    )
+    ds = xr.open_dataset(mapper, engine="zarr", consolidated=False)
+    argmin_y, argmin_x = _nearest_grid_index(latitude, longitude)
+    ds = ds.isel(y=argmin_y, x=argmin_x)
+    valid_times = pd.DatetimeIndex(np.atleast_1d(ds["valid_time"].values))
+    values = {
+        i: np.atleast_1d(ds[i].values)
+        for i in ds.data_vars
+        if i != "gribfile_projection"
+    }
+    ds.close()
+    return valid_times, values
+
+
+def get_grib_data_kerchunk(
+    grib_datetimes,
+    latitude,
+    longitude,
+    search_string_0h,
+    search_string_1h,
+    n_jobs,
+    cache_dir,
+):
+    """Get grib data of many hours through kerchunk references, save in the cache
+    store of cache dir. The hypercubes of the search strings are found from the
+    subset of the first hour, then the remote GRIB files of all hours are indexed
+    once per hypercube and read as one virtual Zarr store, so only the messages of
+    the selected variables are fetched. Requires kerchunk and fsspec, otherwise
+    get_grib_data is used
+
+    PARAMETERS
+    ----------
+    same as get_grib_data
+
+    RETURNS
+    ----------
+    list of datetimes with errors
+    """
+    if scan_grib is None:
+        logger.debug("kerchunk is not installed, reading each hour with Herbie")
+        return get_grib_data(
+            grib_datetimes,
+            latitude,
+            longitude,
+            search_string_0h,
+            search_string_1h,
+            n_jobs,
+            cache_dir,
+        )
+    grib_datetimes = pd.DatetimeIndex(sorted(grib_datetimes))
+    max_threads = min(max(n_jobs, 1) * 4, 64)
+    one_hour = datetime.timedelta(hours=1)
+    found = np.ones(len(grib_datetimes), dtype=bool)
+    analysis_data = {}
+    for fxx, dates, search_string in (
+        (0, grib_datetimes, search_string_0h),
+        (1, grib_datetimes - one_hour, search_string_1h),
+    ):
+        FH = FastHerbie(
+            list(dates),
+            model="hrrr",
+            product="sfc",
+            fxx=[fxx],
+            max_threads=max_threads,
+            priority=["aws"],
+        )
+        grib_urls = [str(H.grib) for H in FH.objects if H.grib is not None]
+        if not grib_urls:
+            return list(grib_datetimes)
+        xarray_data = FH.objects[0].xarray(searchString=search_string)
+        if not isinstance(xarray_data, list):
+            xarray_data = [xarray_data]
+        hypercube_filters = _hypercube_filters(xarray_data)
+        for data_i, filter_by_keys in zip(xarray_data, hypercube_filters):
+            variables = [i for i in data_i.data_vars if i != "gribfile_projection"]
+            try:
+                refs = build_kerchunk_refs(
+                    grib_urls, filter_by_keys | {"cfVarName": variables}, n_jobs
+                )
+                valid_times, values = _read_kerchunk_refs_at_location(
+                    refs, latitude, longitude
+                )
+            except Exception as e:
+                logger.debug(e)
+                return list(grib_datetimes)
+            row_idx = valid_times.get_indexer(grib_datetimes)
+            found &= row_idx >= 0
+            for variable, variable_values in values.items():
+                analysis_data[variable] = np.where(
+                    row_idx >= 0, variable_values[row_idx], np.nan
+                )
+    if found.any():
+        _write_cache_rows(
+            cache_dir,
+            grib_datetimes[found],
+            {k: v[found] for k, v in analysis_data.items()},
+        )
+    return list(grib_datetimes[~found])
+
+
+## Cache Store
+# hourly analysis data is cached in one float32 memmap per year in the site cache
+# directory. Rows are the hours of the year and columns are the grib variable names
+# in `constants._cache_columns`. A JSON sidecar holds the column names, dtype and
+# time index of the store. Rows which have not been downloaded are all NaN.
+_cache_dtype = np.float32
+_cache_freq = "1H"
+
+
+def _cache_store_paths(cache_dir, year):
+    """paths of the memmap data file and JSON sidecar for a year"""
+    base_path = os.path.join(cache_dir, f"{year}")
+    return base_path + ".dat", base_path + ".json"
+
+
+def open_cache_store(cache_dir, year, mode="r+"):
+    """Open the cache store of a year, creating it if it does not exist
+
+    PARAMETERS
+    ----------
+    cache_dir : str, path-like
+        site cache directory
+    year : int
+        year of the store
+    mode : str
+        memmap mode. A store is only created if mode is not "r"
+
+    RETURNS
+    ----------
+    mm : np.memmap, None
+        (n_timestamps, n_vars) array of cached values. None if the store does not
+        exist and mode is "r"
+    columns : list
+        variable names of the columns of mm
+    index : pd.DatetimeIndex
+        timestamps of the rows of mm
+    """
+    data_path, meta_path = _cache_store_paths(cache_dir, year)
+    if not os.path.exists(meta_path):
+        if mode == "r":
+            return None, list(constants._cache_columns), None
+        index = pd.date_range(
+            datetime.datetime(year, 1, 1),
+            datetime.datetime(year + 1, 1, 1),
+            freq=_cache_freq,
+            inclusive="left",
+        )
+        columns = list(constants._cache_columns)
+        mm = np.memmap(
+            data_path, dtype=_cache_dtype, mode="w+", shape=(len(index), len(columns))
+        )
+        mm[:] = np.nan
+        mm.flush()
+        del mm
+        with open(meta_path, "w") as f:
+            json.dump(
+                {
+                    "columns": columns,
+                    "dtype": np.dtype(_cache_dtype).str,
+                    "start": index[0].isoformat(),
+                    "freq": _cache_freq,
+                    "n_rows": len(index),
+                },
+                f,
+            )
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+    index = pd.date_range(meta["start"], periods=meta["n_rows"], freq=meta["freq"])
+    mm = np.memmap(
+        data_path,
+        dtype=meta["dtype"],
+        mode=mode,
+        shape=(meta["n_rows"], len(meta["columns"])),
+    )
+    return mm, meta["columns"], index
+
+
+def _write_cache_row(cache_dir, grib_datetime, analysis_data):
+    """write the values of one hour directly into its row of the cache store"""
+    mm, columns, index = open_cache_store(cache_dir, grib_datetime.year)
+    row_idx = index.get_loc(pd.Timestamp(grib_datetime))
+    mm[row_idx, :] = [analysis_data.get(i, np.nan) for i in columns]
+    mm.flush()
+    del mm
+
+
+def _write_cache_rows(cache_dir, grib_datetimes, analysis_data):
+    """write the values of many hours into the cache store at once
+
+    analysis_data is a dict of variable name: array aligned with grib_datetimes.
+    Rows are written whole, variables missing from analysis_data are NaN
+    """
+    grib_datetimes = pd.DatetimeIndex(grib_datetimes)
+    for year in sorted(set(grib_datetimes.year)):
+        in_year = np.asarray(grib_datetimes.year == year)
+        mm, columns, index = open_cache_store(cache_dir, year)
+        row_idx = index.get_indexer(grib_datetimes[in_year])
+        rows = np.full((len(row_idx), len(columns)), np.nan, dtype=mm.dtype)
+        for col_idx, column in enumerate(columns):
+            if column in analysis_data:
+                rows[:, col_idx] = np.asarray(analysis_data[column])[in_year]
+        # one assignment per row, so a row is never left with only some columns
+        mm[row_idx, :] = rows
+        mm.flush()
+        del mm
+
+
+def read_cache_store(cache_dir, start_date, end_date, freq=_cache_freq):
+    """Read the cache stores between two dates into one dataframe
+
+    PARAMETERS
+    ----------
+    cache_dir : str, path-like
+        site cache directory
+    start_date, end_date : datetime-like
+        first and last timestamps to read (inclusive)
+    freq : str
+        frequency of the returned index
+
+    RETURNS
+    ----------
+    cache_df : pandas.DataFrame
+        cached values with datetime index. Uncached timestamps are all NaN
+    """
     all_dates = pd.date_range(start_date, end_date, freq=freq)
-    all_cache_file_paths = [
-        os.path.join(cache_dir, i.strftime("%Y%m%d%H%M.csv")) for i in all_dates
-    ]
-    all_cache_file_paths.sort()
     cache_dfs = []
-    for data_file in all_cache_file_paths:
-        cache_dfs.append(pd.read_csv(data_file, index_col=0))
-    cache_df = pd.concat(cache_dfs)
-    cache_df.index = pd.to_datetime(cache_df.index)
-    cache_df.sort_index(inplace=True)
-    return cache_df
+    for year in range(all_dates[0].year, all_dates[-1].year + 1):
+        mm, columns, index = open_cache_store(cache_dir, year, mode="r")
+        if mm is None:
+            continue
+        cache_dfs.append(pd.DataFrame(np.asarray(mm), index=index, columns=columns))
+        del mm
+    if not cache_dfs:
+        return pd.DataFrame(
+            np.nan, index=all_dates, columns=list(constants._cache_columns)
+        )
+    return pd.concat(cache_dfs).reindex(all_dates)
+
+
+def get_cached_dates(cache_dir, start_date, end_date, freq=_cache_freq):
+    """timestamps between two dates which have been written to the cache store.
+    Only a row mask is computed from each store, no dataframe of the values is built
+
+    A row counts as written if any of its values is not NaN. The writers fill a
+    whole row in one assignment, so there are no half-written rows, while the
+    variables HRRR does not provide for an hour (e.g. smoke before it was added to
+    the analysis) stay NaN in every download and must not mark the hour uncached
+    """
+    all_dates = pd.date_range(start_date, end_date, freq=freq)
+    cached_dates = []
+    for year in range(all_dates[0].year, all_dates[-1].year + 1):
+        mm, _, index = open_cache_store(cache_dir, year, mode="r")
+        if mm is None:
+            continue
+        cached_dates.append(index[~np.isnan(mm).all(axis=1)])
+        del mm
+    if not cached_dates:
+        return all_dates[:0]
+    return all_dates.intersection(cached_dates[0].append(cached_dates[1:]))
+
+
+def import_legacy_cache_files(cache_dir):
+    """Move per-hour CSV cache files written by earlier versions into the cache store
+
+    Files are named "%Y%m%d%H%M%S.csv", "%Y%m%d%H%M.csv" or "%Y%m%d%H.csv" and hold
+    a single row. Files of hours that are already in the store are not read again.
+    Once the rows are in the store the files are renamed to "<name>.csv.imported",
+    so they are not scanned by later calls and can be deleted.
+
+    RETURNS
+    ----------
+    list of datetimes imported
+    """
+    legacy_formats = {14: "%Y%m%d%H%M%S", 12: "%Y%m%d%H%M", 10: "%Y%m%d%H"}
+    legacy_files = {}
+    # one directory listing, no per-file stat calls
+    with os.scandir(cache_dir) as entries:
+        for entry in entries:
+            stem, extension = os.path.splitext(entry.name)
+            if extension == ".csv" and stem.isdigit() and len(stem) in legacy_formats:
+                file_dt = datetime.datetime.strptime(stem, legacy_formats[len(stem)])
+                legacy_files[file_dt] = entry.path
+    if not legacy_files:
+        return []
+
+    cached_dates = set(
+        get_cached_dates(cache_dir, min(legacy_files), max(legacy_files))
+    )
+    new_files = {
+        file_dt: file_path
+        for file_dt, file_path in sorted(legacy_files.items())
+        if pd.Timestamp(file_dt) not in cached_dates
+    }
+    imported_datetimes = []
+    if new_files:
+        legacy_df = _read_legacy_cache_files(list(new_files.values()))
+        _write_cache_rows(
+            cache_dir,
+            legacy_df.index,
+            {i: legacy_df[i].to_numpy(dtype=float) for i in legacy_df.columns},
+        )
+        imported_datetimes = list(legacy_df.index.to_pydatetime())
+    # every hour of the files is in the store now
+    for file_path in legacy_files.values():
+        os.replace(file_path, file_path + ".imported")
+    return imported_datetimes
+
+
+def _read_legacy_cache_files(file_paths):
+    """Read per-hour CSV cache files into one dataframe with datetime index.
+    All files are parsed in one multithreaded pass with a pyarrow dataset when
+    pyarrow is installed. Files with differing columns are read one at a time
+    """
+    legacy_df = None
+    if pa_ds is not None:
+        try:
+            legacy_df = pa_ds.dataset(file_paths, format="csv").to_table().to_pandas()
+        except (pa.ArrowException, ValueError, TypeError) as e:
+            logger.debug(f"reading cache files one at a time: {e}")
+            legacy_df = pd.concat(
+                [pd.read_csv(i, engine="pyarrow") for i in file_paths]
+            )
+    else:
+        legacy_dfs = []
+        for file_path in file_paths:
+            with open(file_path, buffering=1 << 20) as f:
+                legacy_dfs.append(pd.read_csv(f))
+        legacy_df = pd.concat(legacy_dfs)
+    # the first column is the unnamed datetime index written by DataFrame.to_csv
+    legacy_df = legacy_df.set_index(legacy_df.columns[0])
+    legacy_df.index = pd.to_datetime(legacy_df.index.astype(str), format="ISO8601")
+    legacy_df.index.name = None
+    return legacy_df.sort_index()
+
+
+def combine_cache_files(cache_dir, start_date, end_date, freq):
+    """combine cached data between two dates into one dataframe"""
+    return read_cache_store(cache_dir, start_date, end_date, freq=freq)
+
+
+def calculate_solar_zenith_angle(
+    original_datetime_index, latitude, longitude, method="spa"
+):
+    """Calculate the mean solar zenith angle over the interval ending at each timestamp
+
+    PARAMETERS
+    ----------
+    original_datetime_index : pd.DatetimeIndex
+        timestamps (UTC) with a set frequency
+    latitude : float
+        latitude of location
+    longitude : float
+        longitude of the location
+    method : str
+        "spa": NREL SPA from pvlib sampled every 5 minutes and averaged. Default
+        "analytical": closed form approximation of the solar position evaluated at
+        the start, middle and end of each interval and averaged with Simpson's rule
 
+    RETURNS
+    ----------
+    zenith_df : pd.Series
+        mean solar zenith angle (degrees) indexed by original_datetime_index
+    """
+    # the result only depends on the index, location and method, so repeated runs
+    # for the same site and period are served from a per-process cache
+    tz = original_datetime_index.tz
+    zenith = _cached_solar_zenith_angle(
+        int(original_datetime_index.asi8[0]),
+        len(original_datetime_index),
+        original_datetime_index.freqstr,
+        None if tz is None else str(tz),
+        float(latitude),
+        float(longitude),
+        method,
+    )
+    return pd.Series(zenith.copy(), index=original_datetime_index, name="zenith")
 
-def calculate_solar_zenith_angle(original_datetime_index, latitude, longitude):
-    """Calculate values related to solar position and irradiance"""
+
+@functools.lru_cache(maxsize=16)
+def _cached_solar_zenith_angle(
+    start_ns, periods, freq, tz, latitude, longitude, method
+):
+    """zenith angles of the index rebuilt from its start, length, frequency and tz"""
+    original_datetime_index = pd.date_range(
+        pd.Timestamp(start_ns, tz="UTC").tz_convert(tz), periods=periods, freq=freq
+    )
+    if method == "analytical":
+        zenith_df = _calculate_solar_zenith_angle_analytical(
+            original_datetime_index, latitude, longitude
+        )
+    else:
+        zenith_df = _calculate_solar_zenith_angle_spa(
+            original_datetime_index, latitude, longitude
+        )
+    zenith = zenith_df.to_numpy()
+    zenith.flags.writeable = False
+    return zenith
+
+
+def _calculate_solar_zenith_angle_spa(original_datetime_index, latitude, longitude):
+    """interval mean zenith angle from the pvlib SPA sampled every 5 minutes"""
     offset_timedelta = pd.Timedelta(original_datetime_index.freq)
     dt_index_resampled = pd.date_range(
         original_datetime_index[0] - offset_timedelta,
         original_datetime_index[-1],
         freq="5Min",
     )
-    sp = solarposition.get_solarposition(dt_index_resampled, latitude, longitude)
+    sp = solarposition.get_solarposition(
+        dt_index_resampled, latitude, longitude, method=_get_solar_position_method()
+    )
     zenith_df = (
         sp["zenith"]
         .resample(offset_timedelta, label="right")
-        .mean()[original_datetime_index[0] : original_datetime_index[-1]]
+        .mean()
+        .reindex(original_datetime_index)
     )
-    zenith_df = zenith_df[original_datetime_index[0] : original_datetime_index[-1]]
     return zenith_df
 
 
+@_njit(parallel=True, cache=True)
+def zenith_njit(day_of_year, hour, latitude, longitude):
+    """Closed form approximation of the solar zenith angle [1]
+
+    PARAMETERS
+    ----------
+    day_of_year : np.ndarray
+        day of year (1-366)
+    hour : np.ndarray
+        fractional hour of the day (UTC)
+    latitude : float
+        latitude of location (degrees)
+    longitude : float
+        longitude of the location (degrees east)
+
+    RETURNS
+    ----------
+    zenith : np.ndarray
+        solar zenith angle (degrees)
+
+    References
+    ----------
+    [1] https://gml.noaa.gov/grad/solcalc/solareqns.PDF
+    """
+    gamma = 2 * np.pi / 365 * (day_of_year - 1 + (hour - 12) / 24)
+    equation_of_time = 229.18 * (
+        0.000075
+        + 0.001868 * np.cos(gamma)
+        - 0.032077 * np.sin(gamma)
+        - 0.014615 * np.cos(2 * gamma)
+        - 0.040849 * np.sin(2 * gamma)
+    )
+    declination = (
+        0.006918
+        - 0.399912 * np.cos(gamma)
+        + 0.070257 * np.sin(gamma)
+        - 0.006758 * np.cos(2 * gamma)
+        + 0.000907 * np.sin(2 * gamma)
+        - 0.002697 * np.cos(3 * gamma)
+        + 0.00148 * np.sin(3 * gamma)
+    )
+    true_solar_time = hour * 60 + equation_of_time + 4 * longitude  # minutes
+    hour_angle = np.radians(true_solar_time / 4 - 180)
+    lat = np.radians(latitude)
+    cos_zenith = np.sin(lat) * np.sin(declination) + np.cos(lat) * np.cos(
+        declination
+    ) * np.cos(hour_angle)
+    return np.degrees(np.arccos(np.minimum(np.maximum(cos_zenith, -1.0), 1.0)))
+
+
+def _calculate_solar_zenith_angle_analytical(
+    original_datetime_index, latitude, longitude
+):
+    """interval mean zenith angle from zenith_njit using Simpson's rule"""
+    offset_timedelta = pd.Timedelta(original_datetime_index.freq)
+    # zenith_njit takes UTC hours, naive timestamps are UTC as in pvlib
+    utc_index = original_datetime_index
+    if utc_index.tz is not None:
+        utc_index = utc_index.tz_convert("UTC")
+    zenith_samples = []
+    for fraction in (1.0, 0.5, 0.0):
+        sample_index = utc_index - fraction * offset_timedelta
+        zenith_samples.append(
+            zenith_njit(
+                sample_index.dayofyear.values.astype(np.float64),
+                (
+                    sample_index.hour.values
+                    + sample_index.minute.values / 60
+                    + sample_index.second.values / 3600
+                ).astype(np.float64),
+                float(latitude),
+                float(longitude),
+            )
+        )
+    zenith = (zenith_samples[0] + 4 * zenith_samples[1] + zenith_samples[2]) / 6
+    return pd.Series(zenith, index=original_datetime_index, name="zenith")
+
+
 ## Data Processing Functions
 # Radiation functions
 # HOMER documentation was very helpful here
@@ -208,13 +1229,15 @@ def cloud_cover_to_opaque_sky_cover(lcc, mcc, hcc, tcc, tcc_translucent_ratio=0.
     Parameters
     ----------
     lcc : float
-        low cloud cover (tenths)
+        low cloud cover (%)
     mcc : float
-        mid cloud cover (tenths)
+        mid cloud cover (%)
     hcc : float
-        high cloud cover (tenths)
+        high cloud cover (%)
     tcc : float
-        total cloud cover (tenths)
+        total cloud cover (%)
+    tcc_translucent_ratio : float
+        fraction of the high-only cloud cover that is treated as translucent
 
     Returns
     -----------
@@ -227,18 +1250,71 @@ def cloud_cover_to_opaque_sky_cover(lcc, mcc, hcc, tcc, tcc_translucent_ratio=0.
     [2] http://dx.doi.org/10.1029/2008JD010278
     [3] https://doi.org/10.1016/0038-092X(69)90054-1
     """
+    if ne is not None and isinstance(tcc, np.ndarray):
+        # single fused pass, the clip is written out with where
+        return ne.evaluate(
+            "(tcc - where(tcc - lcc - mcc < 0, 0,"
+            " where(tcc - lcc - mcc > 100, 100, tcc - lcc - mcc)) * r) / 10",
+            local_dict={
+                "tcc": tcc.astype(float, copy=False),
+                "lcc": np.asarray(lcc, dtype=float),
+                "mcc": np.asarray(mcc, dtype=float),
+                "r": float(tcc_translucent_ratio),
+            },
+        )
     translucent_cloud_cover = (
         np.clip(tcc - lcc - mcc, 0, 100) * tcc_translucent_ratio
     )  # estimate of tcc that is only hcc.
     return (tcc - translucent_cloud_cover) / 10
 
 
+_DOY_TO_RAD = 2 * math.pi / 365  # day of year to radians of the earth's orbit
+
+
 def get_extraterrestrial_direct_normal_radiation(day_of_year, G_solar_constant=1361):
     """ """
-    return G_solar_constant * (1 + 0.033 * np.cos(np.radians(360 * day_of_year / 365)))
+    return G_solar_constant * (1.0 + 0.033 * np.cos(_DOY_TO_RAD * day_of_year))
+
 
+# earth-sun distance correction of get_extraterrestrial_direct_normal_radiation by
+# day of year, index 0 is day 1
+_dni_correction_by_doy = get_extraterrestrial_direct_normal_radiation(
+    np.arange(1, 367, dtype=np.float64), G_solar_constant=1.0
+)
 
-def get_extraterrestrial_horizontal_radiation(solar_zenith_angle, G_normal):
+
+def get_eta_dni_vec(day_of_year, G_solar_constant=1361):
+    """get_extraterrestrial_direct_normal_radiation for arrays of day of year.
+    Integer days of year are gathered from a table of the 366 days, fractional days
+    are evaluated in a single pass with numexpr if it is installed
+
+    Parameters
+    ----------
+    day_of_year : array-like
+        day of year (1-366)
+    G_solar_constant : float
+        solar constant (W/m2)
+
+    Returns
+    ----------
+    extraterrestrial direct normal radiation : np.ndarray
+        float64 array of extraterrestrial direct normal radiation (W/m2)
+    """
+    doy = np.asarray(day_of_year)
+    if np.issubdtype(doy.dtype, np.integer):
+        return float(G_solar_constant) * _dni_correction_by_doy[doy - 1]
+    doy = doy.astype(np.float64, copy=False)
+    if ne is None:
+        return get_extraterrestrial_direct_normal_radiation(doy, G_solar_constant)
+    return ne.evaluate(
+        "G * (1.0 + 0.033 * cos(k * doy))",
+        local_dict={"G": float(G_solar_constant), "k": _DOY_TO_RAD, "doy": doy},
+    )
+
+
+def get_extraterrestrial_horizontal_radiation(
+    solar_zenith_angle, G_normal, cos_zenith=None
+):
     """Theoretical solar radiation intensity on a horizontal surface at the top of the atmosphere
 
     Parameters
@@ -247,13 +1323,53 @@ def get_extraterrestrial_horizontal_radiation(solar_zenith_angle, G_normal):
         solar zenith angle (degrees)
     G_normal : float
         extraterrestrial direct normal radiation (W/m2)
+    cos_zenith : float, optional
+        precomputed cosine of the solar zenith angle, see SolarGeometry. If given,
+        solar_zenith_angle is not used
 
     Returns
     ----------
     extraterrestrial_horizontal_radiation : float
         extraterrestrial horizontal radiation (W/m2)
     """
-    return G_normal * np.cos(np.radians(solar_zenith_angle))
+    if cos_zenith is None:
+        cos_zenith = np.cos(np.radians(solar_zenith_angle))
+    return G_normal * cos_zenith
+
+
+@dataclass
+class SolarGeometry:
+    """Solar geometry of a timeseries. Computed once and shared by the radiation
+    and illuminance calculations so the trigonometry is not repeated
+
+    Attributes
+    ----------
+    zenith_deg : np.ndarray
+        solar zenith angle (degrees)
+    cos_zenith : np.ndarray
+        cosine of the solar zenith angle
+    doy : np.ndarray
+        day of year (1-366)
+    g_normal : np.ndarray
+        extraterrestrial direct normal radiation (W/m2)
+    """
+
+    zenith_deg: np.ndarray
+    cos_zenith: np.ndarray
+    doy: np.ndarray
+    g_normal: np.ndarray
+
+    @classmethod
+    def from_zenith(cls, zenith_deg, doy, G_solar_constant=1361):
+        """populate the solar geometry from zenith angles and days of year"""
+        zenith_deg = np.asarray(zenith_deg, dtype=np.float64)
+        doy = np.asarray(doy)
+        return cls(
+            zenith_deg=zenith_deg,
+            cos_zenith=np.cos(np.radians(zenith_deg)),
+            doy=doy,
+            g_normal=get_eta_dni_vec(doy, G_solar_constant),
+        )
 
 
 def sky_emissivity(T_dew, opaque_sky_cover):
@@ -276,12 +1392,11 @@ def sky_emissivity(T_dew, opaque_sky_cover):
     [1] Walton, G.N. Thermal Analysis Research Program Reference Manual; US Department of Commerce, National Bureau of Standards: Washington, DC, USA, March 1983.
     [2] Clark, G.; Allen, C. The estimation of atmospheric radiation for clear and cloudy skies. In Proceedings of the 2nd National Passive Solar Conference (AS/ISES), Philadelphia, PA, USA, 16–18 March 1978; pp. 675–678.
     """
-    return (
-        (0.787 + 0.767 * np.log(T_dew / 273))
-        + (0.0224 * opaque_sky_cover)
-        - 0.0035 * opaque_sky_cover**2
-        + 0.00028 * opaque_sky_cover**3
-    )
+    # cloud cover polynomial in Horner form
+    c = opaque_sky_cover
+    return (0.787 + 0.767 * np.log1p((T_dew - 273) * (1 / 273))) + (
+        (0.00028 * c - 0.0035) * c + 0.0224
+    ) * c
 
 
 def horizontal_ir(T_dry, T_dew, opaque_sky_cover, sig=5.6697e-8):
@@ -310,6 +1425,25 @@ def horizontal_ir(T_dry, T_dew, opaque_sky_cover, sig=5.6697e-8):
     return sky_emissivity(T_dew, opaque_sky_cover) * sig * T_dry**4
 
 
+def horizontal_ir_vec(T_dry, T_dew, opaque_sky_cover, sig=5.6697e-8):
+    """horizontal_ir fused into a single pass over arrays with numexpr.
+    Falls back to horizontal_ir if numexpr is not installed. See horizontal_ir
+    """
+    if ne is None:
+        return horizontal_ir(T_dry, T_dew, opaque_sky_cover, sig=sig)
+    return ne.evaluate(
+        "(0.787 + 0.767 * log1p((T_dew - 273) * (1 / 273))"
+        " + ((0.00028 * osc - 0.0035) * osc + 0.0224) * osc)"
+        " * sig * T_dry**4",
+        local_dict={
+            "T_dry": np.asarray(T_dry, dtype=float),
+            "T_dew": np.asarray(T_dew, dtype=float),
+            "osc": np.asarray(opaque_sky_cover, dtype=float),
+            "sig": sig,
+        },
+    )
+
+
 def solar_irradiance_to_lux(G):
     """Convert solar irradiance to luminance which only measures visible light
     Assumes Linear approximation of luminous efficacy of solar radiation.
@@ -333,16 +1467,238 @@ def solar_irradiance_to_lux(G):
     return G * 122
 
 
-def get_coordinate_projections(date, latitude, longitude):
+## Derived quantities
+# outputs of calculate_derived_quantities, in the row order of the kernel output
+_derived_quantities = (
+    "opaque_sky_cover",
+    "extraterrestrial_horizontal_irradiance",
+    "horizontal_ir",
+    "ghi",
+    "global illuminance",
+    "normal illuminance",
+    "horizontal illuminance",
+    "zenith illuminance",
+    "wind_E",
+    "wind_N",
+    "wind direction",
+    "wind speed",
+)
+
+
+@_njit(parallel=True, fastmath=_fastmath, cache=True)
+def _derived_quantities_kernel(
+    t2m,
+    d2m,
+    lcc,
+    mcc,
+    tcc,
+    vbdsf,
+    vddsf,
+    u10,
+    v10,
+    cos_zenith,
+    g_normal,
+    uc0,
+    uc1,
+    vc0,
+    vc1,
+    tcc_translucent_ratio,
+    sig,
+    out,
+):
+    """one pass over the rows computing every output of _derived_quantities.
+    Same formulas as the individual functions, see calculate_derived_quantities"""
+    for i in _prange(t2m.shape[0]):
+        # cloud_cover_to_opaque_sky_cover
+        high_cloud_cover = tcc[i] - lcc[i] - mcc[i]
+        if high_cloud_cover < 0.0:
+            high_cloud_cover = 0.0
+        elif high_cloud_cover > 100.0:
+            high_cloud_cover = 100.0
+        osc = (tcc[i] - high_cloud_cover * tcc_translucent_ratio) / 10
+        # horizontal_ir
+        emissivity = (
+            0.787
+            + 0.767 * math.log1p((d2m[i] - 273) * (1 / 273))
+            + ((0.00028 * osc - 0.0035) * osc + 0.0224) * osc
+        )
+        t2m_sq = t2m[i] * t2m[i]
+        # irradiance and illuminance
+        direct_horizontal = vbdsf[i] * cos_zenith[i]
+        ghi = direct_horizontal + vddsf[i]
+        # wind
+        wind_e = u10[i] * uc0 + v10[i] * vc0
+        wind_n = u10[i] * uc1 + v10[i] * vc1
+        wind_direction = math.degrees(math.atan2(wind_e, wind_n))
+        if wind_direction < 0:
+            wind_direction += 360
+
+        out[0, i] = osc
+        out[1, i] = g_normal[i] * cos_zenith[i]
+        out[2, i] = emissivity * sig * t2m_sq * t2m_sq
+        out[3, i] = ghi
+        out[4, i] = ghi * 122
+        out[5, i] = vbdsf[i] * 122
+        out[6, i] = vddsf[i] * 122
+        out[7, i] = direct_horizontal * 122
+        out[8, i] = wind_e
+        out[9, i] = wind_n
+        out[10, i] = wind_direction
+        out[11, i] = math.sqrt(wind_e * wind_e + wind_n * wind_n)
+
+
+def calculate_derived_quantities(
+    t2m,
+    d2m,
+    lcc,
+    mcc,
+    hcc,
+    tcc,
+    vbdsf,
+    vddsf,
+    u10,
+    v10,
+    solar_geometry,
+    uc,
+    vc,
+    tcc_translucent_ratio=0.5,
+    sig=5.6697e-8,
+):
+    """Calculate the quantities derived from the HRRR analysis data in one fused
+    pass. With numba the formulas of cloud_cover_to_opaque_sky_cover,
+    get_extraterrestrial_horizontal_radiation, horizontal_ir,
+    solar_irradiance_to_lux and wind_from_uv run in a single parallel kernel,
+    otherwise those functions are called on the arrays
+
+    PARAMETERS
+    ----------
+    t2m, d2m : np.ndarray
+        dry bulb and dew point temperature (K)
+    lcc, mcc, hcc, tcc : np.ndarray
+        low, mid, high and total cloud cover (%)
+    vbdsf, vddsf : np.ndarray
+        direct and diffuse radiation (W/m2)
+    u10, v10 : np.ndarray
+        u and v wind components (m/s)
+    solar_geometry : SolarGeometry
+        solar geometry of the rows
+    uc, vc : tuple
+        coordinate projections, see get_coordinate_projections
+    tcc_translucent_ratio : float
+        see cloud_cover_to_opaque_sky_cover
+    sig : float
+        Stefan-Boltzmann constant (W/m2/K4)
+
+    RETURNS
+    ----------
+    derived_quantities : dict
+        name in _derived_quantities: np.ndarray
+    """
+    inputs = (t2m, d2m, lcc, mcc, tcc, vbdsf, vddsf, u10, v10)
+    # float32 inputs (e.g. from the cache store) are computed in float32, anything
+    # else in float64
+    dtype = np.result_type(np.float32, *(np.asarray(i).dtype for i in inputs))
+    arrays = [np.ascontiguousarray(i, dtype=dtype) for i in inputs]
+    if numba is None:
+        t2m, d2m, lcc, mcc, tcc, vbdsf, vddsf, u10, v10 = arrays
+        hcc = np.asarray(hcc, dtype=dtype)
+        cos_zenith = np.asarray(solar_geometry.cos_zenith, dtype=dtype)
+        g_normal = np.asarray(solar_geometry.g_normal, dtype=dtype)
+        opaque_sky_cover = cloud_cover_to_opaque_sky_cover(
+            lcc, mcc, hcc, tcc, tcc_translucent_ratio
+        )
+        direct_horizontal = vbdsf * cos_zenith
+        ghi = direct_horizontal + vddsf
+        wind_e, wind_n, wind_direction, wind_speed = wind_from_uv(u10, v10, uc, vc)
+        outputs = (
+            opaque_sky_cover,
+            get_extraterrestrial_horizontal_radiation(
+                None, g_normal, cos_zenith=cos_zenith
+            ),
+            horizontal_ir_vec(t2m, d2m, opaque_sky_cover, sig=sig),
+            ghi,
+            solar_irradiance_to_lux(ghi),
+            solar_irradiance_to_lux(vbdsf),
+            solar_irradiance_to_lux(vddsf),
+            solar_irradiance_to_lux(direct_horizontal),
+            wind_e,
+            wind_n,
+            wind_direction,
+            wind_speed,
+        )
+        # numexpr evaluates in float64, return the dtype of the numba kernel
+        return {
+            name: np.asarray(output).astype(dtype, copy=False)
+            for name, output in zip(_derived_quantities, outputs)
+        }
+    (uc0, uc1), (vc0, vc1) = uc, vc
+    out = np.empty((len(_derived_quantities), arrays[0].shape[0]), dtype=dtype)
+    _derived_quantities_kernel(
+        *arrays,
+        np.ascontiguousarray(solar_geometry.cos_zenith, dtype=dtype),
+        np.ascontiguousarray(solar_geometry.g_normal, dtype=dtype),
+        float(uc0),
+        float(uc1),
+        float(vc0),
+        float(vc1),
+        float(tcc_translucent_ratio),
+        float(sig),
+        out,
+    )
+    return dict(zip(_derived_quantities, out))
+
+
+## HRRR grid
+# the HRRR grid is the same for every analysis, so the grid coordinates and the
+# nearest grid point of a location are only found once per process
+_grid_reference_date = "2022-1-1 00:00"
+
+
+@functools.lru_cache(maxsize=8)
+def _get_hrrr_dataset(date_key, search_string, product="sfc", fxx=0):
+    """cached xarray dataset of HRRR fields returned by Herbie"""
+    H = Herbie(date_key, model="hrrr", product=product, fxx=fxx)
+    return H.xarray(search_string)
+
+
+def _get_hrrr_grid():
+    """latitude and longitude arrays of the HRRR grid"""
+    ds = _get_hrrr_dataset(_grid_reference_date, ":VGTYP:")
+    return ds.latitude.values, ds.longitude.values
+
+
+@functools.lru_cache(maxsize=1)
+def _get_hrrr_kdtree():
+    """KD-tree of the (latitude, longitude) points of the HRRR grid"""
+    latitudes, longitudes = _get_hrrr_grid()
+    return cKDTree(np.column_stack([latitudes.ravel(), longitudes.ravel()]))
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_nearest_grid_index(latitude, longitude):
+    """(y, x) index of the HRRR grid point nearest a location"""
+    latitudes, _ = _get_hrrr_grid()
+    _, flat_index = _get_hrrr_kdtree().query([latitude, longitude])
+    argmin_y, argmin_x = np.unravel_index(flat_index, latitudes.shape)
+    return int(argmin_y), int(argmin_x)
+
+
+def _nearest_grid_index(latitude, longitude):
+    """nearest grid point index, cached on the location rounded to 4 decimals"""
+    return _get_nearest_grid_index(round(latitude, 4), round(longitude, 4))
+
+
+def get_coordinate_projections(latitude, longitude):
     """use surrounding grid points to estimate the compass direction of the coordinate vectors
     to be used in the form:
     wind E/W = u_speed * u[0] + v_speed * v[0]
     wind N/S = u_speed * u[1] + v_speed * v[1]
 
+    The HRRR grid is the same for all dates, so the projections only depend on the
+    grid point nearest the location and are cached per grid point
+
     PARMAETERS
     ----------
-    date : string, datetime
-        date of the HRRR analysis
     latitude : float
         latitude of location. Must be between 21.14 N and 52.6 N for HRRR
     longitude : float
@@ -355,14 +1711,13 @@ def get_coordinate_projections(date, latitude, longitude):
     v : tuple
         tuple of floats representing the longitude and latitude components of the v vector
     """
-    H = Herbie(date, model="hrrr", product="sfc", fxx=0)
-    ds = H.xarray("(:UGRD:10 m above ground:anl)|(:VGRD:10 m above ground:anl)")
-    latitudes = ds.latitude.values
-    longitudes = ds.longitude.values
-    distance = (ds.longitude.values - longitude) ** 2 + (
-        ds.latitude.values - latitude
-    ) ** 2
-    argmin_y, argmin_x = divmod(distance.argmin(), distance.shape[1])
+    return _get_coordinate_projections(*_nearest_grid_index(latitude, longitude))
+
+
+@functools.lru_cache(maxsize=4096)
+def _get_coordinate_projections(argmin_y, argmin_x):
+    """coordinate projections at a grid point"""
+    latitudes, longitudes = _get_hrrr_grid()
 
     x_lon = (
         longitudes[argmin_y, argmin_x + 1] - longitudes[argmin_y, argmin_x - 1]
@@ -403,8 +1758,11 @@ def convert_uv_projection_to_en(u, v, uc, vc):
     n : float
         northward wind component (m/s)
     """
-    e = u * uc[0] + v * vc[0]
-    n = u * uc[1] + v * vc[1]
+    (uc0, uc1), (vc0, vc1) = uc, vc
+    u = np.asarray(u)
+    v = np.asarray(v)
+    e = u * uc0 + v * vc0
+    n = u * uc1 + v * vc1
     return e, n
 
 
@@ -413,19 +1771,17 @@ def get_wind_direction(e, n):
 
     Parameters
     ----------
-    u : float
-        u wind component (m/s) (positive eastward)
-    v : float
-        v wind component (m/s) (positive northward)
+    e : float, array-like
+        eastward wind component (m/s)
+    n : float, array-like
+        northward wind component (m/s)
 
     Returns
     ----------
     wind direction (degrees)
     """
     deg = np.rad2deg(np.arctan2(e, n))
-    if deg < 0:
-        deg = 360 + deg
-    return deg
+    return np.where(deg < 0, 360 + deg, deg)
 
 
 def get_wind_speed(e, n):
@@ -445,6 +1801,31 @@ def get_wind_speed(e, n):
     return np.sqrt(e**2 + n**2)
 
 
+def wind_from_uv(u, v, uc, vc):
+    """Eastward and northward wind components, wind direction and wind speed from
+    the u and v wind components in one call. The speed uses np.hypot, so no
+    squared temporaries are allocated
+
+    PARAMETERS
+    ----------
+    u, v : float, array-like
+        u and v wind components (m/s)
+    uc, vc : tuple
+        coordinate projections, see get_coordinate_projections
+
+    RETURNS
+    ----------
+    e, n : np.ndarray
+        eastward and northward wind components (m/s)
+    wind_direction : np.ndarray
+        wind direction (degrees), see get_wind_direction
+    wind_speed : np.ndarray
+        wind speed (m/s)
+    """
+    e, n = convert_uv_projection_to_en(u, v, uc, vc)
+    return e, n, get_wind_direction(e, n), np.hypot(e, n)
+
+
 def T_wet(T_dry, RH, allow_estimation=True):
     """Approximation to estimate wet bulb temperature
     Analytical equation from "Wet-Bulb Temperature from Relative Humidity and Air Temperature" Roland Stull
@@ -490,29 +1871,123 @@ def T_wet(T_dry, RH, allow_estimation=True):
 
     # approximated fit
     if not estimated_output:
-        T_wet = (
-            20 * np.arctan(0.151_977 * (RH + 8.313_659) ** 0.5)
-            + np.arctan(T_dry + RH)
-            - np.arctan(RH - 1.676_331)
-            - 0.003_918_38 * RH**1.5 * np.arctan(0.023_101 * RH)
-            - 4.686_035
-        )
+        T_wet = _twet_core(float(T_dry), float(RH))
     else:
         T_wet = T_dry
     return T_wet + 273.15
 
 
+# compiled on the first T_wet call, cache=True keeps it on disk for later processes
+@_njit(cache=True, fastmath=True)
+def _twet_core(T_dry, RH):
+    """Stull wet bulb approximation (C) for a single validated T_dry (C) and RH (%)"""
+    return (
+        20 * math.atan(0.151_977 * math.sqrt(RH + 8.313_659))
+        + math.atan(T_dry + RH)
+        - math.atan(RH - 1.676_331)
+        - 0.003_918_38 * math.pow(RH, 1.5) * math.atan(0.023_101 * RH)
+        - 4.686_035
+    )
+
+
+
+def T_wet_vec(T_dry, RH, allow_estimation=True):
+    """Vectorized approximation to estimate wet bulb temperature over arrays.
+    Same approximation and validity limits as T_wet, see T_wet for details
+
+    Parameters
+    ----------
+    T_dry : array-like (253.15 - 323.15)
+        Dry bulb temperature (K)
+    RH : array-like (5-99)
+        Relative Humidity (%)
+
+    Returns
+    ----------
+    T_wet : np.ndarray
+        Wet bulb temperature (K). Where the inputs are outside the valid region of
+        the approximation the dry bulb temperature is used as the estimate. NaN
+        where either input is NaN
+    """
+    # convert T_dry to C
+    T_dry = np.asarray(T_dry, dtype=float) - 273.15
+    RH = np.minimum(np.asarray(RH, dtype=float), 99)
+
+    # T_dry limits
+    if np.any((T_dry < -20) | (T_dry > 50)):
+        raise ValueError("T_dry must be between -20 and 50 C")
+    # RH limits and low T, low RH region. Missing (NaN) inputs stay NaN
+    valid = (RH >= 5) & ((-75 * T_dry - 31 * RH + 825) >= 0)
+    missing = np.isnan(T_dry) | np.isnan(RH)
+    if not allow_estimation and not (valid | missing).all():
+        raise ValueError("T_dry and RH combination is not valid for this approximation")
+
+    # approximated fit
+    if numba is not None:
+        T_dry, RH, valid = np.broadcast_arrays(T_dry, RH, valid)
+        T_wet = np.empty(T_dry.shape)
+        _twet_kernel(T_dry.ravel(), RH.ravel(), valid.ravel(), T_wet.reshape(-1))
+        return T_wet
+    T_wet = (
+        20 * np.arctan(0.151_977 * np.sqrt(RH + 8.313_659))
+        + np.arctan(T_dry + RH)
+        - np.arctan(RH - 1.676_331)
+        - 0.003_918_38 * RH**1.5 * np.arctan(0.023_101 * RH)
+        - 4.686_035
+    )
+    T_wet = np.where(valid, T_wet, T_dry) + 273.15
+    return np.where(missing, np.nan, T_wet)
+
+
+@_njit(parallel=True, fastmath=_fastmath, cache=True)
+def _twet_kernel(T_dry, RH, valid, out):
+    """T_wet_vec in one pass with _twet_core, T_dry (C) where not valid and NaN
+    where an input is missing. Writes K"""
+    for i in _prange(T_dry.shape[0]):
+        if np.isnan(T_dry[i]) or np.isnan(RH[i]):
+            out[i] = np.nan
+        elif valid[i]:
+            out[i] = _twet_core(T_dry[i], RH[i]) + 273.15
+        else:
+            out[i] = T_dry[i] + 273.15
+
+
 def get_albedo(latitude, longitude):
-    """"""
-    H = Herbie("2022-1-1 00:00", model="hrrr", product="sfc", fxx=0)
-    ds = H.xarray(":VGTYP:")
-    distances = (ds.longitude.values - longitude) ** 2 + (
-        ds.latitude.values - latitude
-    ) ** 2
-    argmin_y, argmin_x = divmod(distances.argmin(), distances.shape[1])
+    """albedo of the HRRR land use category nearest a location, cached per grid
+    point like the coordinate projections"""
+    return _get_albedo(*_nearest_grid_index(latitude, longitude))
+
+
+@functools.lru_cache(maxsize=4096)
+def _get_albedo(argmin_y, argmin_x):
+    """albedo at a grid point"""
+    ds = _get_hrrr_dataset(_grid_reference_date, ":VGTYP:")
     vgtyp = int(ds.gppbfas.isel(y=argmin_y, x=argmin_x).values)
-    albedo = constants.land_use_categories.get(vgtyp).get("albedo")
-    return albedo
+    return float(land_use_to_albedo(vgtyp))
+
+
+def land_use_to_albedo(vgtyp):
+    """Map land use category numbers to albedo with a lookup table
+
+    Parameters
+    ----------
+    vgtyp : int or array-like of int
+        HRRR VGTYP land use category numbers (1-21), e.g. the whole raster
+
+    Returns
+    ----------
+    albedo : float or np.ndarray
+        albedo of each category, NaN for unknown categories
+    """
+    vgtyp = np.asarray(vgtyp, dtype=float)
+    known = (vgtyp >= 0) & (vgtyp < len(constants._albedo_lut))
+    # out of range and NaN categories are gathered from index 0 and masked to NaN
+    albedo = constants._albedo_lut.take(np.where(known, vgtyp, 0).astype(np.intp))
+    return np.where(known, albedo, np.nan)
+
+
+# code 8 digits by smoke bucket, see parse_weather_code
+_smoke_codes = ("9", "0", "1")
 
 
 def parse_weather_code(
@@ -760,13 +2235,8 @@ def parse_weather_code(
         9 = None
 
         Notes: These values recorded only when visibility is less than 11 km."""
-        # NOTE: not used as these aren't measured
-        code = 9
-        if smoke > 5e-4:  # kg/m^3
-            code = 1
-        elif smoke > 1e-5:
-            code = 0
-        return code
+        # smoke mass density (kg/m^3) bucket: 0 = none, 1 = smoke, 2 = haze
+        return _smoke_codes[int(smoke > 1e-5) + int(smoke > 5e-4)]
 
     # def code9_ice_pellets():
     #     """
@@ -810,7 +2280,143 @@ def parse_weather_code(
             ice_code = code6_sleet(accumulated_precipitation)
             weather_code[5] = ice_code
             weather_code[8] = ice_code
-    if smoke > 1e5:
+    if smoke is not None and smoke > 1e-5:
         weather_code[7] = code8_smoke_haze(smoke)
 
     return "".join(weather_code)
+
+
+# representative values of the buckets of the continuous inputs of
+# parse_weather_code. Every threshold of parse_weather_code falls between them
+_weather_code_buckets = {
+    "accumulated_precipitation": (0.0, 1.0, 5.0, 10.0),  # none, < 2.5, < 7.6, more
+    "pct_frozen_precipitation": (0.0, 50.0),  # <= 0, more
+    "visibility": (2.0, 0.75, 0.25),  # > 1, > 0.5, less
+    "wind_gust_speed": (10.0, 20.0, 30.0),  # <= 15, <= 25.7, more
+    "smoke": (0.0, 1e-4, 1e-3),  # <= 1e-5, <= 5e-4, more
+}
+
+
+@functools.lru_cache(maxsize=1)
+def _get_weather_code_lut():
+    """Weather codes of every combination of the categorical flags and the buckets
+    of the continuous inputs, from parse_weather_code. Indexed by
+    [flags, precipitation, frozen, visibility, gust, smoke] where flags packs
+    freezing rain, ice pellets, rain, snow and lightning as bits 0-4"""
+    shape = (32,) + tuple(len(i) for i in _weather_code_buckets.values())
+    lut = np.empty(shape, dtype="U9")
+    for index in np.ndindex(shape):
+        flags, *buckets = index
+        values = {
+            name: representatives[bucket]
+            for (name, representatives), bucket in zip(
+                _weather_code_buckets.items(), buckets
+            )
+        }
+        lut[index] = parse_weather_code(
+            freezing_rain=bool(flags & 1),
+            ice_pellets=bool(flags & 2),
+            rain=bool(flags & 4),
+            snow=bool(flags & 8),
+            lightning=bool(flags & 16),
+            **values,
+        )
+    return lut
+
+
+def parse_weather_code_vec(
+    accumulated_precipitation,
+    freezing_rain,
+    ice_pellets,
+    lightning,
+    rain,
+    snow,
+    pct_frozen_precipitation,
+    visibility,
+    wind_gust_speed,
+    smoke,
+):
+    """
+    Vectorized parse_weather_code. Parse arrays of weather data into 9-character
+    strings for energy plus use with the same rules as parse_weather_code, by
+    packing the inputs into an index of a precomputed lookup table
+    see : https://bigladdersoftware.com/epx/docs/8-3/auxiliary-programs/energyplus-weather-file-epw-data-dictionary.html
+
+    Parameters
+    ----------
+    same as parse_weather_code, as array-likes of equal length
+
+    Returns
+    ----------
+    weather_codes : np.ndarray
+        9-character strings of weather data.
+    """
+    accumulated_precipitation = np.asarray(accumulated_precipitation, dtype=float)
+    pct_frozen_precipitation = np.asarray(pct_frozen_precipitation, dtype=float)
+    visibility = np.asarray(visibility, dtype=float)
+    wind_gust_speed = np.asarray(wind_gust_speed, dtype=float)
+    smoke = np.asarray(smoke, dtype=float)
+
+    # categorical flags. NaN is truthy, as in parse_weather_code
+    flags = np.zeros(accumulated_precipitation.shape, dtype=np.uint8)
+    for bit, flag in enumerate((freezing_rain, ice_pellets, rain, snow, lightning)):
+        flags |= np.asarray(flag).astype(bool).astype(np.uint8) << bit
+
+    # buckets of the continuous inputs. comparisons with NaN are False, as in
+    # parse_weather_code
+    precipitation_bucket = np.where(
+        accumulated_precipitation > 0,
+        1
+        + (accumulated_precipitation >= 2.5).astype(np.uint8)
+        + (accumulated_precipitation >= 7.6).astype(np.uint8),
+        0,
+    )
+    frozen_bucket = (~(pct_frozen_precipitation <= 0)).astype(np.uint8)
+    visibility_bucket = (~(visibility > 1)).astype(np.uint8) + (
+        ~(visibility > 0.5)
+    ).astype(np.uint8)
+    gust_bucket = (wind_gust_speed > 15).astype(np.uint8) + (
+        wind_gust_speed > 25.7
+    ).astype(np.uint8)
+    smoke_bucket = (smoke > 1e-5).astype(np.uint8) + (smoke > 5e-4).astype(np.uint8)
+
+    return _get_weather_code_lut()[
+        flags,
+        precipitation_bucket,
+        frozen_bucket,
+        visibility_bucket,
+        gust_bucket,
+        smoke_bucket,
+    ]
+
+
+def days_since_last_snowfall(index, snow):
+    """Days since the last snowfall for the EnergyPlus weather file, in calendar days
+    of the wall time of the index. 0 on days with snow, 99 (missing) before the
+    first day with snow and for gaps of 99 days or more
+
+    Parameters
+    ----------
+    index : pd.DatetimeIndex
+        timestamps of the rows
+    snow : array-like
+        categorical snow of each row, NaN is no snow
+
+    Returns
+    ----------
+    days_since_last_snowfall : np.ndarray of int16
+    """
+    wall_time = index
+    if wall_time.tz is not None:
+        wall_time = wall_time.tz_localize(None)
+    day_number = wall_time.asi8 // 86_400_000_000_000
+    days, day_of_row = np.unique(day_number, return_inverse=True)
+    snow_by_day = np.bincount(day_of_row, weights=np.nan_to_num(snow)) > 0
+    last_snow_day = np.maximum.accumulate(
+        np.where(snow_by_day, np.arange(len(days)), -1)
+    )[day_of_row]
+    return (
+        np.where(last_snow_day >= 0, day_number - days[last_snow_day], 99)
+        .clip(0, 99)
+        .astype(np.int16)
+    )
@@ -2,33 +2,23 @@ import logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s',
     filename='logs/0_get_data.log', filemode='w')
 
-import datetime
 import os
 import sys
 
-import pandas as pd
-
 sys.path.append(os.path.join("..", "AMY"))
 import constants, core, utils
+from common import san_antonio
 
 # declarations
-start_date = datetime.datetime(2021, 12, 31, 19)
-# end_date = datetime.datetime(2023, 8, 1)
-end_date = datetime.datetime(2022, 1, 2)
 n_workers = 5
 cache_dir = os.path.join("..", "cache")
 
-san_antonio = {
-    "latitude" : 29.25,  # N
-    "longitude" :   360-98.31,  # W
-    "begin_date" : datetime.datetime(2022,1,1),
-    "end_date" : datetime.datetime(2023,1,1)
-}
-
-# 
-all_dates = pd.date_range(start_date, end_date, freq="1H")
-dl_dates = [i for i in all_dates if not 
-            os.path.exists(os.path.join(cache_dir, i.strftime("%Y%m%d%H%M.csv")))]
+# one directory listing instead of a stat call per date
+os.makedirs(cache_dir, exist_ok=True)
+cached_files = {i.name for i in os.scandir(cache_dir) if i.name.endswith(".csv")}
+dl_dates = [
+    i for i in san_antonio["hourly_index"] if i.strftime("%Y%m%d%H%M.csv") not in cached_files
+]
 
 search_string_0h = utils.get_search_string([i.get("searchstring") for i in constants._grib_variables_0h.values()])
 search_string_1h = utils.get_search_string([i.get("searchstring") for i in constants._grib_variables_1h.values()])
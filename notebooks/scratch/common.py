@@ -5,21 +5,29 @@ import logging
 logger = logging.getLogger(__name__)
 
 import datetime
+import functools
+import hashlib
 import os
+from zoneinfo import ZoneInfo
 
-from herbie import Herbie
+from herbie import FastHerbie, Herbie
+import numpy as np
 import pandas as pd
-import pytz
 
 # constants
 ## locations
 san_antonio = {
     "latitude" : 29.25,  # N
     "longitude" :   360-98.31,  # W
-    "tz" : pytz.timezone('America/Chicago'),
+    "tz" : ZoneInfo('America/Chicago'),
     "begin_date" : datetime.datetime(2022,1,1),
     "end_date" : datetime.datetime(2023,1,1)
 }
+# hourly analysis times of the local dates, built once for all callers. HRRR dates
+# are naive UTC, so the index is too
+san_antonio["hourly_index"] = pd.date_range(
+    san_antonio["begin_date"], san_antonio["end_date"], freq="1h", tz=san_antonio["tz"]
+).tz_convert("UTC").tz_localize(None)
 
 ## HRRR stuff
 land_use_categories = {
@@ -90,7 +98,7 @@ variable_properties = {
     "liquid precipitation quantity": {"units":"hours", "position":34, "missing":99, "ep_used" : False}
 }
 
-_body_column_order = [] # TODO sort with "position" in variable_properties values
+_body_column_order = tuple(sorted(variable_properties, key=lambda k: variable_properties[k]["position"]))
 _grib_variables_sfc = {
     # variable name: {search_string, byte_start, byte_end, location_indices}
     # PRIMARY VARIABLES
@@ -188,7 +196,7 @@ def cloud_cover_to_opaque_sky_cover(lcc, mcc, hcc, tcc):
     [2] http://dx.doi.org/10.1029/2008JD010278
     [3] https://doi.org/10.1016/0038-092X(69)90054-1
     """
-    translucent_cloud_cover = max(tcc - lcc - mcc, 0)
+    translucent_cloud_cover = np.maximum(tcc - lcc - mcc, 0)
     return tcc - translucent_cloud_cover * 0.3
 
 def sky_emissivity(T_dew, opaque_sky_cover):
@@ -210,10 +218,10 @@ def sky_emissivity(T_dew, opaque_sky_cover):
     [1] Walton, G.N. Thermal Analysis Research Program Reference Manual; US Department of Commerce, National Bureau of Standards: Washington, DC, USA, March 1983.
     [2] Clark, G.; Allen, C. The estimation of atmospheric radiation for clear and cloudy skies. In Proceedings of the 2nd National Passive Solar Conference (AS/ISES), Philadelphia, PA, USA, 16–18 March 1978; pp. 675–678.
     """
-    return (0.787 + 0.767 * np.log(T_dew/273)) +\
-        (0.0224 * opaque_sky_cover) -\
-        0.0035 * opaque_sky_cover**2 +\
-        0.00028 * opaque_sky_cover**3
+    # cloud cover polynomial in Horner form
+    c = opaque_sky_cover
+    return (0.787 + 0.767 * np.log1p((T_dew - 273) * (1 / 273))) +\
+        ((0.00028 * c - 0.0035) * c + 0.0224) * c
 
 def horizontal_ir(T_dry, T_dew, opaque_sky_cover, sig=5.6697e-8):
     """Approximation for horizontal infrared radiation intensity
@@ -277,7 +285,7 @@ def get_wind_direction(u, v):
     ----------
     wind direction (degrees)
     """
-    return 180 + (180 / np.pi) * np.arctan2(v,u) % 360
+    return (180 + (180 / np.pi) * np.arctan2(v,u)) % 360
 
 def get_wind_speed(u, v):
     """Use u and v wind components to calculate wind speed
@@ -302,49 +310,45 @@ def T_wet(T_dry, RH, allow_estimation=True):
     
     Parameters
     ----------
-    T_dry : float (253.15 - 323.15)
+    T_dry : float or array-like (253.15 - 323.15)
         Dry bulb temperature (K)
-    RH : float (5-99)
+    RH : float or array-like (5-99)
         Relative Humidity (%)
     
     Returns
     ----------
-    T_wet : float
+    T_wet : np.ndarray
         Wet bulb temperature (K)
     """
     # convert T_dry to C
-    T_dry = T_dry - 273.15
+    T_dry = np.asarray(T_dry, dtype=float) - 273.15
+    RH = np.asarray(RH, dtype=float)
     
     # validate the ranges of the inputs
-    estimated_output = False
-    # RH limits
-    if RH < 5:
-        if not allow_estimation:
-            raise ValueError("RH must be greater than 5% for this approximation")
-        estimated_output = True
-    if RH > 99:
-        RH = 99
     # T_dry limits
-    if T_dry < -20 or T_dry > 50:
+    if np.any((T_dry < -20) | (T_dry > 50)):
         raise ValueError("T_dry must be between -20 and 50 C")
+    # RH limits
+    estimated_output = RH < 5
+    if np.any(estimated_output) and not allow_estimation:
+        raise ValueError("RH must be greater than 5% for this approximation")
+    RH = np.minimum(RH, 99)
     # low T, low RH region
     # valid_limit_1 = (-20, 75)  # (T_dry, RH)
     # valid_limit_2 = (11, 0)    # (T_dry, RH)
     # line: -75 * T_dry + -31 * RH + 825 = 0
-    if (-75 * T_dry - 31 * RH + 825) < 0:
-        if not allow_estimation:
-            raise ValueError("T_dry and RH combination is not valid for this approximation")
-        estimated_output = True
+    invalid_combination = (-75 * T_dry - 31 * RH + 825) < 0
+    if np.any(invalid_combination) and not allow_estimation:
+        raise ValueError("T_dry and RH combination is not valid for this approximation")
+    estimated_output = estimated_output | invalid_combination
         
-    # approximated fit
-    if not estimated_output:
-        T_wet = 20 * np.arctan(0.151_977 * (RH + 8.313_659)**0.5) +\
-            np.arctan(T_dry + RH) -\
-            np.arctan(RH - 1.676_331) -\
-            0.003_918_38 * RH**1.5 * np.arctan(0.023_101 * RH) -\
-            4.686_035
-    else:
-        T_wet = T_dry
+    # approximated fit, T_dry where the fit is not valid
+    T_wet = 20 * np.arctan(0.151_977 * (RH + 8.313_659)**0.5) +\
+        np.arctan(T_dry + RH) -\
+        np.arctan(RH - 1.676_331) -\
+        0.003_918_38 * RH**1.5 * np.arctan(0.023_101 * RH) -\
+        4.686_035
+    T_wet = np.where(estimated_output, T_dry, T_wet)
     return T_wet + 273.15
 
 def get_search_string(list_of_searches):
@@ -360,38 +364,115 @@ def get_search_string(list_of_searches):
     search_string : str
         search string for herbie
     """
-    mid_string = ")|(".join(list_of_searches)
+    return _get_search_string(tuple(list_of_searches))
+
+@functools.lru_cache(maxsize=32)
+def _get_search_string(searches):
+    """cached get_search_string for a tuple of search strings"""
+    mid_string = ")|(".join(searches)
     return "(" + mid_string + ")"
 
+# search string of all surface variables, built once at import
+_search_string_sfc = get_search_string(i.get("searchstring") for i in _grib_variables_sfc.values())
+
+def get_grib_data_path(grib_dt, data_dir, search_string, longitude, latitude):
+    """Cache file of one analysis hour. The name holds a hash of the search string
+    and location, so changing either does not reuse stale cache files"""
+    key = f"{search_string}|{longitude:.4f}|{latitude:.4f}".encode()
+    digest = hashlib.blake2b(key, digest_size=8).hexdigest()
+    return os.path.join(data_dir, f"{grib_dt:%Y%m%d%H}_{digest}.csv")
+
+# (longitude, latitude): (y, x) index of the nearest HRRR grid point. The grid is
+# the same for every analysis so it is only searched once per location
+_nearest_grid_indices = {}
+
+def _get_nearest_grid_index(ds, longitude, latitude):
+    """index of the grid point of dataset ds nearest the location"""
+    key = (round(longitude, 4), round(latitude, 4))
+    if key not in _nearest_grid_indices:
+        lat = ds.latitude.values
+        lon = ds.longitude.values
+        # equirectangular distance is enough to rank the points around the location
+        distance = (lat - latitude)**2 + ((lon - longitude) * np.cos(np.radians(latitude)))**2
+        iy, ix = np.unravel_index(np.argmin(distance), lat.shape)
+        _nearest_grid_indices[key] = (int(iy), int(ix))
+    return _nearest_grid_indices[key]
+
+def _get_herbie_data(H, grib_dt, data_path, search_string, longitude, latitude):
+    """values of the search_string variables of Herbie object H at the location,
+    saved to data_path"""
+    analysis_data = {}
+    logger.debug("JEH: Using XARRAY")
+    h_data = H.xarray(searchString=search_string)
+    logger.debug("JEH: Finding Individual Data Values at location")
+    for h_data_i in h_data:
+        logger.debug("JEH: ----Individual dataset selected")
+        h_data_i = h_data_i.drop_vars(["time", "step", "valid_time"])
+        logger.debug("JEH: ----Locating nearest point")
+        iy, ix = _get_nearest_grid_index(h_data_i, longitude, latitude)
+        h_data_i = h_data_i.isel(y=iy, x=ix).drop_vars("gribfile_projection", errors="ignore")
+        logger.debug("JEH: --------Adding variable values at location")
+        data_vars = list(h_data_i.data_vars)
+        if data_vars:
+            values = h_data_i[data_vars].to_array().values.reshape(len(data_vars), -1)[:, 0]
+            analysis_data.update(zip(data_vars, values))
+    logger.debug("JEH: Creating Dataframe")
+    df = pd.DataFrame(data=analysis_data, index=[grib_dt])
+    logger.debug("JEH: Saving CSV")
+    df.to_csv(data_path)
+    logger.debug("JEH: Done")
+    return df
+
 def get_grib_data(grib_dt, data_dir, search_string, longitude, latitude):
+    data_path = get_grib_data_path(grib_dt, data_dir, search_string, longitude, latitude)
+    if os.path.exists(data_path):
+        logger.debug("JEH: Reading cached CSV")
+        return pd.read_csv(data_path, index_col=0, parse_dates=True)
     try:
-        data_path = os.path.join(data_dir, grib_dt.strftime("%Y%m%d%H.csv"))
-        if not os.path.exists(data_path):
-            logger.debug("JEH: Creating Herbie Object")
-            H = Herbie(
-                grib_dt,
-                model='hrrr',
-                product='sfc'
-            )
-            analysis_data = {}
-            logger.debug("JEH: Using XARRAY")
-            h_data = H.xarray(searchString=search_string)
-            logger.debug("JEH: Finding Individual Data Values at location")
-            for h_data_i in h_data:
-                logger.debug("JEH: ----Individual dataset selected")
-                h_data_i = h_data_i.drop_vars(["time", "step", "valid_time"])
-                logger.debug("JEH: ----Locating nearest point")
-                h_data_i = h_data_i.herbie.nearest_points((longitude, latitude))
-                for data_var in list(h_data_i.data_vars)[:-1]:
-                        logger.debug("JEH: --------Adding variable value at location")
-                        analysis_data[data_var] = h_data_i[data_var].values[0]
-            logger.debug("JEH: Creating Dataframe")
-            df = pd.DataFrame(data=analysis_data, index=[grib_dt])
-            logger.debug("JEH: Saving CSV")
-            df.to_csv(data_path)
-            logger.debug("JEH: Done")
-            return df
-    except Exception as e:
-        print(e)
-    return 
+        logger.debug("JEH: Creating Herbie Object")
+        H = Herbie(
+            grib_dt,
+            model='hrrr',
+            product='sfc'
+        )
+        return _get_herbie_data(H, grib_dt, data_path, search_string, longitude, latitude)
+    except Exception:
+        logger.exception(f"JEH: Failed to get HRRR data for {grib_dt}")
+        raise
 
+def get_grib_data_range(grib_dts, data_dir, search_string, longitude, latitude, max_threads=16):
+    """get_grib_data for many hours. The Herbie objects of all uncached hours are
+    created and their subsets downloaded in parallel with one FastHerbie, then each
+    hour is read from its local file
+    
+    Returns
+    ----------
+    data : pd.DataFrame
+        values of all hours that could be read, indexed by hour
+    """
+    dfs = []
+    uncached = {}
+    for grib_dt in grib_dts:
+        grib_dt = pd.Timestamp(grib_dt)
+        if grib_dt.tz is not None:
+            # keys must match the naive UTC dates of the Herbie objects
+            grib_dt = grib_dt.tz_convert("UTC").tz_localize(None)
+        data_path = get_grib_data_path(grib_dt, data_dir, search_string, longitude, latitude)
+        if os.path.exists(data_path):
+            dfs.append(pd.read_csv(data_path, index_col=0, parse_dates=True))
+        else:
+            uncached[grib_dt] = data_path
+    if uncached:
+        logger.debug("JEH: Creating FastHerbie Object")
+        FH = FastHerbie(list(uncached), model='hrrr', product='sfc', max_threads=max_threads)
+        FH.download(search_string, max_threads=max_threads)
+        for H in FH.objects:
+            grib_dt = pd.Timestamp(H.date)
+            try:
+                dfs.append(_get_herbie_data(H, grib_dt, uncached[grib_dt], search_string, longitude, latitude))
+            except Exception:
+                # the hour is missing from the result and is retried on the next call
+                logger.exception(f"JEH: Failed to get HRRR data for {grib_dt}")
+    if not dfs:
+        return pd.DataFrame()
+    return pd.concat(dfs).sort_index()
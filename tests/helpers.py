@@ -0,0 +1,181 @@
+"""Offline HRRR fixtures for the download and read paths of gnomy.utils
+
+Small Lambert conformal GRIB2 files are written with eccodes and served from an
+in-memory "remote" through a Herbie subclass that never touches the network
+"""
+
+import datetime
+from pathlib import Path
+
+# herbie (and with it pyproj) is imported before eccodes, the other order aborts
+# at interpreter exit with some builds of the two libraries
+from herbie import Herbie
+import eccodes
+import numpy as np
+import pandas as pd
+
+## GRIB fixtures
+# variable: (parameterCategory, parameterNumber, typeOfFirstFixedSurface, level,
+# wgrib2 variable and level of the index file)
+_parameters = {
+    "t2m": (0, 0, 103, 2, "TMP:2 m above ground"),
+    "d2m": (0, 6, 103, 2, "DPT:2 m above ground"),
+    "r2": (1, 1, 103, 2, "RH:2 m above ground"),
+    "sp": (3, 0, 1, 0, "PRES:surface"),
+    "gust": (2, 22, 1, 0, "GUST:surface"),
+    "prate": (1, 7, 1, 0, "PRATE:surface"),
+}
+# r2 and gust are never searched, so the subsets are not contiguous in the files
+variables_0h = ("t2m", "r2", "d2m", "sp")
+variables_1h = ("gust", "prate")
+search_string_0h = "(?::TMP:2 m above ground|:DPT:2 m above ground|:PRES:surface)"
+search_string_1h = ":PRATE:"
+grid_shape = (4, 5)
+# grid point read by the tests, see patch of utils._nearest_grid_index
+grid_index = (1, 2)
+
+
+def field_values(variable, date, fxx):
+    """grid values of a variable, different for every variable and hour"""
+    offset = list(_parameters).index(variable) * 100 + date.hour * 10 + fxx
+    return 250.0 + offset + np.arange(np.prod(grid_shape)).reshape(grid_shape)
+
+
+def grib_message(variable, date, fxx):
+    """one GRIB2 message of a variable on a 4x5 Lambert conformal grid"""
+    category, number, surface_type, level, _ = _parameters[variable]
+    h = eccodes.codes_grib_new_from_samples("GRIB2")
+    try:
+        for key, value in (
+            ("gridDefinitionTemplateNumber", 30),
+            ("shapeOfTheEarth", 6),
+            ("Nx", grid_shape[1]),
+            ("Ny", grid_shape[0]),
+            ("latitudeOfFirstGridPointInDegrees", 29.0),
+            ("longitudeOfFirstGridPointInDegrees", 261.5),
+            ("LaDInDegrees", 38.5),
+            ("LoVInDegrees", 262.5),
+            ("Latin1InDegrees", 38.5),
+            ("Latin2InDegrees", 38.5),
+            ("DxInMetres", 3000.0),
+            ("DyInMetres", 3000.0),
+            ("dataDate", int(f"{date:%Y%m%d}")),
+            ("dataTime", date.hour * 100),
+            ("productDefinitionTemplateNumber", 0),
+            ("discipline", 0),
+            ("parameterCategory", category),
+            ("parameterNumber", number),
+            ("typeOfFirstFixedSurface", surface_type),
+        ):
+            eccodes.codes_set(h, key, value)
+        if surface_type == 103:
+            eccodes.codes_set(h, "scaledValueOfFirstFixedSurface", level)
+            eccodes.codes_set(h, "scaleFactorOfFirstFixedSurface", 0)
+        eccodes.codes_set(h, "forecastTime", fxx)
+        eccodes.codes_set(h, "bitsPerValue", 16)
+        eccodes.codes_set_values(h, field_values(variable, date, fxx).ravel())
+        return eccodes.codes_get_message(h)
+    finally:
+        eccodes.codes_release(h)
+
+
+class FakeRemote:
+    """In-memory HRRR archive of GRIB files and their wgrib2 style indexes.
+    Records the range requests and the Herbie downloads made against it"""
+
+    def __init__(self):
+        self.files = {}
+        self.indexes = {}
+        self.range_requests = []
+        self.herbie_downloads = []
+
+    def add_file(self, url, date, fxx):
+        variables = variables_0h if fxx == 0 else variables_1h
+        messages = [grib_message(i, date, fxx) for i in variables]
+        start_bytes = np.cumsum([0] + [len(i) for i in messages[:-1]])
+        forecast_time = "anl" if fxx == 0 else f"{fxx} hour fcst"
+        index = pd.DataFrame(
+            {
+                "grib_message": np.arange(1, len(messages) + 1),
+                "start_byte": start_bytes,
+                # the end of the last message is not in a wgrib2 index
+                "end_byte": list(start_bytes[1:] - 1) + [np.nan],
+                "search_this": [
+                    f":{_parameters[i][4]}:{forecast_time}" for i in variables
+                ],
+            }
+        )
+        self.files[url] = b"".join(messages)
+        self.indexes[url] = index.set_index("grib_message", drop=False)
+
+    def read(self, url, start_byte, end_byte=None):
+        data = self.files[url]
+        return data[start_byte : None if end_byte is None else end_byte + 1]
+
+
+class OfflineHerbie(Herbie):
+    """Herbie object of a FakeRemote file. Only the remote lookup of Herbie is
+    replaced, the local file paths, inventory and xarray reads are Herbie's own"""
+
+    def __init__(
+        self,
+        date,
+        *,
+        remote,
+        save_dir,
+        model="hrrr",
+        product="sfc",
+        fxx=0,
+        verbose=False,
+        **kwargs,
+    ):
+        self.date = pd.Timestamp(date)
+        self.fxx = fxx
+        self.model = model
+        self.product = product
+        self.verbose = verbose
+        self.priority = None
+        self.DESCRIPTION = "offline HRRR fixture"
+        self.IDX_STYLE = "wgrib2"
+        self.LOCALFILE = f"hrrr.t{self.date:%H}z.wrf{product}f{fxx:02d}.grib2"
+        url = f"https://example.com/hrrr.{self.date:%Y%m%d}/conus/{self.LOCALFILE}"
+        self.SOURCES = {"aws": url}
+        self.save_dir = Path(save_dir)
+        self.remote = remote
+        if url not in remote.files:
+            remote.add_file(url, self.date, fxx)
+        self.grib = url
+        self.idx = url + ".idx"
+        self.__dict__["index_as_dataframe"] = remote.indexes[url]
+
+    def download(self, search=None, **kwargs):
+        """write the subset like Herbie.download, recording the call"""
+        self.remote.herbie_downloads.append((self.grib, search))
+        local_path = self.get_localFilePath(search)
+        local_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(local_path, "wb") as f:
+            for row in self.inventory(search).itertuples():
+                end_byte = None if pd.isna(row.end_byte) else int(row.end_byte)
+                f.write(self.remote.read(self.grib, int(row.start_byte), end_byte))
+        return local_path
+
+
+def herbie_factory(remote, save_dir):
+    """drop-in replacement of herbie.Herbie for gnomy.utils"""
+
+    def factory(date, **kwargs):
+        return OfflineHerbie(date, remote=remote, save_dir=save_dir, **kwargs)
+
+    return factory
+
+
+def expected_row(grib_datetime):
+    """cache row values of an hour at grid_index"""
+    values = {
+        i: field_values(i, grib_datetime, 0)[grid_index]
+        for i in ("t2m", "d2m", "sp")
+    }
+    values["prate"] = field_values(
+        "prate", grib_datetime - datetime.timedelta(hours=1), 1
+    )[grid_index]
+    return values
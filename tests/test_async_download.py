@@ -0,0 +1,146 @@
+"""The asyncio range-request prefetch of async_get_grib_data against an offline
+HRRR archive. The subsets it writes must be the files the following Herbie pass
+of get_grib_data reads, so no hour is downloaded twice"""
+
+import datetime
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from gnomy import utils
+import helpers
+
+
+class FakeResponse:
+    """aiohttp response of a range request"""
+
+    def __init__(self, body):
+        self.status = 206
+        self.body = body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    async def read(self):
+        return self.body
+
+
+class FakeSession:
+    """aiohttp.ClientSession serving byte ranges of a helpers.FakeRemote"""
+
+    def __init__(self, remote):
+        self.remote = remote
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def get(self, url, headers):
+        start_byte, end_byte = headers["Range"].removeprefix("bytes=").split("-")
+        self.remote.range_requests.append((url, headers["Range"]))
+        return FakeResponse(
+            self.remote.read(
+                url, int(start_byte), int(end_byte) if end_byte else None
+            )
+        )
+
+
+def fake_aiohttp(remote):
+    """stand-in of the aiohttp module as used by gnomy.utils"""
+    return types.SimpleNamespace(
+        ClientTimeout=lambda **kwargs: None,
+        TCPConnector=lambda **kwargs: None,
+        ClientSession=lambda **kwargs: FakeSession(remote),
+    )
+
+
+class TestAsyncGetGribData(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache_dir = tmp_dir.name
+        self.save_dir = f"{tmp_dir.name}/hrrr"
+        self.remote = helpers.FakeRemote()
+        self.grib_datetimes = [datetime.datetime(2022, 1, 1, i) for i in (3, 4, 5)]
+        for patcher in (
+            mock.patch.object(
+                utils, "Herbie", helpers.herbie_factory(self.remote, self.save_dir)
+            ),
+            mock.patch.object(utils, "aiohttp", fake_aiohttp(self.remote)),
+            mock.patch.object(
+                utils, "_nearest_grid_index", lambda *args: helpers.grid_index
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def async_get_grib_data(self):
+        return utils.async_get_grib_data(
+            self.grib_datetimes,
+            30.0,
+            -98.0,
+            helpers.search_string_0h,
+            helpers.search_string_1h,
+            concurrency=4,
+            cache_dir=self.cache_dir,
+        )
+
+    def test_prefetched_subsets_are_read_by_herbie(self):
+        failed_datetimes = self.async_get_grib_data()
+
+        self.assertEqual(failed_datetimes, [])
+        # every hour was read from the prefetched subsets, Herbie downloaded nothing
+        self.assertEqual(self.remote.herbie_downloads, [])
+        for grib_datetime in self.grib_datetimes:
+            for H, search_string in (
+                (utils.Herbie(grib_datetime, fxx=0), helpers.search_string_0h),
+                (
+                    utils.Herbie(grib_datetime - datetime.timedelta(hours=1), fxx=1),
+                    helpers.search_string_1h,
+                ),
+            ):
+                self.assertTrue(H.get_localFilePath(search_string).exists())
+
+        cache_df = utils.read_cache_store(
+            self.cache_dir, self.grib_datetimes[0], self.grib_datetimes[-1]
+        )
+        for grib_datetime in self.grib_datetimes:
+            for variable, value in helpers.expected_row(grib_datetime).items():
+                np.testing.assert_allclose(
+                    cache_df.loc[grib_datetime, variable], value, rtol=1e-5
+                )
+
+    def test_only_the_searched_messages_are_requested(self):
+        self.async_get_grib_data()
+
+        # t2m is separated from d2m and sp by the unsearched r2, so each 0h file
+        # takes two range requests. The 1h PRATE message is last and read to the end
+        requests_0h = [i for i in self.remote.range_requests if "f00" in i[0]]
+        requests_1h = [i for i in self.remote.range_requests if "f01" in i[0]]
+        self.assertEqual(len(requests_0h), 2 * len(self.grib_datetimes))
+        self.assertEqual(len(requests_1h), len(self.grib_datetimes))
+        self.assertTrue(all(i[1].endswith("-") for i in requests_1h))
+
+    def test_existing_subsets_are_not_requested_again(self):
+        self.async_get_grib_data()
+        n_requests = len(self.remote.range_requests)
+
+        self.async_get_grib_data()
+
+        self.assertEqual(len(self.remote.range_requests), n_requests)
+        self.assertEqual(self.remote.herbie_downloads, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+"""The batched read path of get_grib_data_batch against an offline HRRR archive.
+It must write the same cache rows as reading each hour with get_grib_data"""
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import cfgrib
+import pandas as pd
+
+from gnomy import utils
+import helpers
+
+
+class FakeFastHerbie:
+    """FastHerbie of helpers.OfflineHerbie objects, downloaded one after another"""
+
+    def __init__(self, DATES, fxx, herbie_factory, **kwargs):
+        self.objects = [herbie_factory(i, fxx=j) for i in DATES for j in fxx]
+
+    def download(self, search, **kwargs):
+        for H in self.objects:
+            H.download(search)
+
+    @property
+    def file_exists(self):
+        return [H for H in self.objects if H.grib is not None]
+
+
+def _concatenate_grib_files(file_paths, latitude, longitude, out_path, **kwargs):
+    """_crop_grib_files without wgrib2, the messages are concatenated uncropped"""
+    with open(out_path, "wb") as f:
+        for file_path in file_paths:
+            with open(file_path, "rb") as grib_file:
+                f.write(grib_file.read())
+
+
+class TestGetGribDataBatch(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+        for cache_dir in ("hourly", "batch"):
+            os.makedirs(f"{self.tmp_dir}/{cache_dir}")
+        self.remote = helpers.FakeRemote()
+        self.grib_datetimes = [datetime.datetime(2022, 1, 1, i) for i in (3, 4, 5)]
+        herbie_factory = helpers.herbie_factory(self.remote, f"{self.tmp_dir}/hrrr")
+        for patcher in (
+            mock.patch.object(utils, "Herbie", herbie_factory),
+            mock.patch.object(
+                utils,
+                "FastHerbie",
+                lambda *args, **kwargs: FakeFastHerbie(
+                    *args, herbie_factory=herbie_factory, **kwargs
+                ),
+            ),
+            mock.patch.object(
+                utils, "_nearest_grid_index", lambda *args: helpers.grid_index
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # the cropped read finds the nearest point from the coordinates, so the
+        # location is the grid point of helpers.grid_index
+        H = herbie_factory(self.grib_datetimes[0], fxx=0)
+        H.download(helpers.search_string_0h)
+        ds = cfgrib.open_datasets(
+            H.get_localFilePath(helpers.search_string_0h),
+            backend_kwargs={"indexpath": ""},
+        )[0]
+        self.latitude = float(ds.latitude.values[helpers.grid_index])
+        self.longitude = float(ds.longitude.values[helpers.grid_index]) - 360
+
+    def get_grib_data(self, cache_dir, batch):
+        return utils.get_grib_data(
+            self.grib_datetimes,
+            self.latitude,
+            self.longitude,
+            helpers.search_string_0h,
+            helpers.search_string_1h,
+            1,
+            cache_dir,
+            batch=batch,
+        )
+
+    def assert_same_cache_rows(self):
+        self.assertEqual(self.get_grib_data(f"{self.tmp_dir}/hourly", False), [])
+        self.assertEqual(self.get_grib_data(f"{self.tmp_dir}/batch", True), [])
+
+        hourly_df, batch_df = (
+            utils.read_cache_store(
+                f"{self.tmp_dir}/{i}", self.grib_datetimes[0], self.grib_datetimes[-1]
+            )
+            for i in ("hourly", "batch")
+        )
+        pd.testing.assert_frame_equal(batch_df, hourly_df)
+        self.assertEqual(
+            list(hourly_df.dropna(axis=1)), ["t2m", "d2m", "sp", "prate"]
+        )
+
+    def test_open_mfdataset_matches_hourly_reads(self):
+        with mock.patch.object(utils.shutil, "which", return_value=None):
+            self.assert_same_cache_rows()
+
+    def test_cropped_file_matches_hourly_reads(self):
+        with mock.patch.object(
+            utils.shutil, "which", return_value="wgrib2"
+        ), mock.patch.object(utils, "_crop_grib_files", _concatenate_grib_files):
+            self.assert_same_cache_rows()
+
+    @unittest.skipIf(shutil.which("wgrib2") is None, "wgrib2 is not on the PATH")
+    def test_wgrib2_crop_matches_hourly_reads(self):
+        self.assert_same_cache_rows()
+
+    def test_missing_hours_are_returned(self):
+        # the analysis of the second hour is not in the archive
+        missing_file = property(
+            lambda FH: [
+                H for H in FH.objects if (H.date, H.fxx) != (self.grib_datetimes[1], 0)
+            ]
+        )
+        with mock.patch.object(
+            utils.shutil, "which", return_value=None
+        ), mock.patch.object(FakeFastHerbie, "file_exists", missing_file):
+            failed_datetimes = self.get_grib_data(f"{self.tmp_dir}/batch", True)
+
+        self.assertEqual(failed_datetimes, [pd.Timestamp(self.grib_datetimes[1])])
+        batch_df = utils.read_cache_store(
+            f"{self.tmp_dir}/batch", self.grib_datetimes[0], self.grib_datetimes[-1]
+        )
+        self.assertTrue(batch_df.loc[self.grib_datetimes[1]].isna().all())
+        for grib_datetime in self.grib_datetimes[::2]:
+            for variable, value in helpers.expected_row(grib_datetime).items():
+                self.assertAlmostEqual(
+                    batch_df.loc[grib_datetime, variable], value, places=3
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+"""The per-year memmap cache store: writes, reads, year boundaries and partially
+filled rows"""
+
+import datetime
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from gnomy import constants, utils
+
+
+def _analysis_data(n_rows, columns=constants._cache_columns):
+    """distinct values of every column for n_rows hours"""
+    return {
+        column: np.arange(n_rows, dtype=float) + 1000 * col_idx + 0.5
+        for col_idx, column in enumerate(columns)
+    }
+
+
+class TestCacheStore(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache_dir = tmp_dir.name
+
+    def test_new_store_is_all_nan(self):
+        mm, columns, index = utils.open_cache_store(self.cache_dir, 2022)
+
+        self.assertEqual(columns, list(constants._cache_columns))
+        self.assertEqual(len(index), 8760)
+        self.assertEqual(index[0], pd.Timestamp(2022, 1, 1))
+        self.assertEqual(mm.shape, (8760, len(columns)))
+        self.assertEqual(mm.dtype, np.float32)
+        self.assertTrue(np.isnan(mm).all())
+        with open(os.path.join(self.cache_dir, "2022.json")) as f:
+            self.assertEqual(json.load(f)["columns"], columns)
+
+    def test_missing_store_is_not_created_in_read_mode(self):
+        mm, columns, index = utils.open_cache_store(self.cache_dir, 2022, mode="r")
+
+        self.assertIsNone(mm)
+        self.assertIsNone(index)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+        self.assertEqual(
+            len(utils.get_cached_dates(self.cache_dir, "2022-1-1", "2022-1-2")), 0
+        )
+        self.assertTrue(
+            utils.read_cache_store(self.cache_dir, "2022-1-1", "2022-1-2")
+            .isna()
+            .all(axis=None)
+        )
+
+    def test_round_trip(self):
+        grib_datetimes = pd.date_range("2022-3-1", periods=5, freq="1h")
+        analysis_data = _analysis_data(len(grib_datetimes))
+        utils._write_cache_rows(self.cache_dir, grib_datetimes, analysis_data)
+        # a single row, with a variable that is not a cache column
+        single_datetime = datetime.datetime(2022, 3, 1, 7)
+        single_row = {i: values[0] for i, values in analysis_data.items()}
+        utils._write_cache_row(
+            self.cache_dir, single_datetime, single_row | {"not_a_column": 1.0}
+        )
+
+        cache_df = utils.read_cache_store(
+            self.cache_dir, grib_datetimes[0], single_datetime
+        )
+        self.assertEqual(list(cache_df), list(constants._cache_columns))
+        self.assertEqual(len(cache_df), 8)
+        expected = pd.DataFrame(analysis_data, index=grib_datetimes)
+        pd.testing.assert_frame_equal(
+            cache_df.loc[grib_datetimes], expected.astype(np.float32)
+        )
+        self.assertTrue(cache_df.loc["2022-3-1 05:00"].isna().all())
+        np.testing.assert_array_equal(
+            cache_df.loc[single_datetime].to_numpy(),
+            np.float32(list(single_row.values())),
+        )
+        self.assertEqual(
+            list(
+                utils.get_cached_dates(
+                    self.cache_dir, grib_datetimes[0], single_datetime
+                )
+            ),
+            list(grib_datetimes) + [pd.Timestamp(single_datetime)],
+        )
+
+    def test_year_boundary(self):
+        grib_datetimes = pd.date_range("2021-12-31 22:00", periods=4, freq="1h")
+        utils._write_cache_rows(
+            self.cache_dir, grib_datetimes, _analysis_data(len(grib_datetimes))
+        )
+
+        self.assertEqual(
+            sorted(os.listdir(self.cache_dir)),
+            ["2021.dat", "2021.json", "2022.dat", "2022.json"],
+        )
+        mm_2021, _, index_2021 = utils.open_cache_store(self.cache_dir, 2021, "r")
+        self.assertEqual(
+            list(index_2021[~np.isnan(mm_2021).all(axis=1)]), list(grib_datetimes[:2])
+        )
+        cache_df = utils.read_cache_store(
+            self.cache_dir, "2021-12-31 21:00", "2022-1-1 02:00"
+        )
+        self.assertEqual(len(cache_df), 6)
+        np.testing.assert_array_equal(
+            cache_df["t2m"].to_numpy(), [np.nan, 0.5, 1.5, 2.5, 3.5, np.nan]
+        )
+        self.assertEqual(
+            list(
+                utils.get_cached_dates(
+                    self.cache_dir, "2021-12-31 21:00", "2022-1-1 02:00"
+                )
+            ),
+            list(grib_datetimes),
+        )
+
+    def test_partially_filled_rows(self):
+        grib_datetimes = pd.date_range("2022-6-1", periods=3, freq="1h")
+        # the hours have values of some variables only, e.g. no smoke in the analysis
+        utils._write_cache_rows(
+            self.cache_dir, grib_datetimes, _analysis_data(3, ["t2m", "d2m"])
+        )
+        # writing again replaces the whole row, no values of the first write remain
+        utils._write_cache_rows(
+            self.cache_dir, grib_datetimes[1:2], _analysis_data(1, ["sp"])
+        )
+
+        cache_df = utils.read_cache_store(
+            self.cache_dir, grib_datetimes[0], grib_datetimes[-1]
+        )
+        self.assertEqual(
+            list(cache_df.dropna(axis=1, how="all")), ["t2m", "d2m", "sp"]
+        )
+        self.assertTrue(cache_df.loc[grib_datetimes[1], ["t2m", "d2m"]].isna().all())
+        self.assertEqual(cache_df.loc[grib_datetimes[1], "sp"], 0.5)
+        # rows with any value are cached, the hour after them is not
+        cached_dates = utils.get_cached_dates(
+            self.cache_dir, grib_datetimes[0], grib_datetimes[-1] + pd.Timedelta("1h")
+        )
+        self.assertEqual(list(cached_dates), list(grib_datetimes))
+
+
+class TestImportLegacyCacheFiles(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache_dir = tmp_dir.name
+        self.file_datetimes = pd.date_range("2022-2-1", periods=3, freq="1h")
+        # one file per hour in each of the legacy name formats
+        for file_dt, name_format in zip(
+            self.file_datetimes, ("%Y%m%d%H%M%S", "%Y%m%d%H%M", "%Y%m%d%H")
+        ):
+            legacy_df = pd.DataFrame(
+                {"t2m": [280.5 + file_dt.hour], "sp": [1e5]}, index=[file_dt]
+            )
+            file_name = f"{file_dt:{name_format}}.csv"
+            legacy_df.to_csv(os.path.join(self.cache_dir, file_name))
+
+    def test_files_are_imported_once(self):
+        # the first hour is already in the store and is not overwritten
+        utils._write_cache_row(self.cache_dir, self.file_datetimes[0], {"t2m": 1.0})
+
+        imported = utils.import_legacy_cache_files(self.cache_dir)
+
+        self.assertEqual(imported, list(self.file_datetimes[1:].to_pydatetime()))
+        cache_df = utils.read_cache_store(
+            self.cache_dir, self.file_datetimes[0], self.file_datetimes[-1]
+        )
+        np.testing.assert_array_equal(cache_df["t2m"].to_numpy(), [1.0, 281.5, 282.5])
+        np.testing.assert_array_equal(cache_df["sp"].to_numpy(), [np.nan, 1e5, 1e5])
+        file_names = os.listdir(self.cache_dir)
+        self.assertFalse(any(i.endswith(".csv") for i in file_names))
+        self.assertEqual(len([i for i in file_names if i.endswith(".imported")]), 3)
+        self.assertEqual(utils.import_legacy_cache_files(self.cache_dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+"""days_since_last_snowfall on small fixed hourly series"""
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from gnomy import utils
+
+
+def _snow_on(index, snow_hours):
+    """categorical snow of the rows, 1 at the given timestamps"""
+    return index.isin(pd.DatetimeIndex(snow_hours)).astype(float)
+
+
+def _daily(values):
+    """expected output of 5 days of 6-hourly rows from one value per day"""
+    return np.repeat(np.array(values, dtype=np.int16), 4)
+
+
+class TestDaysSinceLastSnowfall(unittest.TestCase):
+    def setUp(self):
+        self.index = pd.date_range("2022-1-1", periods=20, freq="6h")
+
+    def assert_days(self, snow, expected, index=None):
+        index = self.index if index is None else index
+        days = utils.days_since_last_snowfall(index, snow)
+        self.assertEqual(days.dtype, np.int16)
+        np.testing.assert_array_equal(days, expected)
+
+    def test_no_snow(self):
+        self.assert_days(np.zeros(20), _daily([99] * 5))
+        self.assert_days(np.full(20, np.nan), _daily([99] * 5))
+
+    def test_snow_on_day_0(self):
+        # the hours before the snow on the same day are 0 too
+        snow = _snow_on(self.index, ["2022-1-1 18:00"])
+        self.assert_days(snow, _daily([0, 1, 2, 3, 4]))
+
+    def test_multi_day_gap(self):
+        snow = _snow_on(self.index, ["2022-1-2 00:00", "2022-1-4 12:00"])
+        snow[6] = np.nan
+        self.assert_days(snow, _daily([99, 0, 1, 0, 1]))
+
+    def test_missing_days_in_the_index(self):
+        # calendar days are counted, not the days present in the data
+        index = pd.DatetimeIndex(
+            ["2022-1-1 12:00", "2022-1-5 12:00", "2022-1-6 00:00"]
+        )
+        self.assert_days(np.array([1.0, 0.0, 0.0]), [0, 4, 5], index=index)
+
+    def test_local_wall_time(self):
+        # 20:00 and 23:00 in Chicago are the same local day, in UTC they are not
+        index = pd.date_range(
+            "2022-1-1 20:00", periods=3, freq="3h", tz="America/Chicago"
+        )
+        self.assert_days(np.array([1.0, 0.0, 0.0]), [0, 0, 1], index=index)
+
+    def test_long_gaps_are_missing(self):
+        index = pd.date_range("2022-1-1", periods=120, freq="1D")
+        snow = np.zeros(120)
+        snow[0] = 1
+        expected = np.minimum(np.arange(120), 99)
+        self.assert_days(snow, expected, index=index)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+"""The fused numba kernel of calculate_derived_quantities against the fallback
+that calls the individual functions"""
+
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from gnomy import utils
+
+# coordinate projections of a grid point rotated a few degrees from north
+_uc = (0.996, -0.087)
+_vc = (0.087, 0.996)
+
+
+def _inputs(dtype, n_rows=2000):
+    """random analysis rows with every sign of the wind components, including NaN"""
+    rng = np.random.default_rng(1)
+    lcc, mcc, tcc = (rng.uniform(0, 100, n_rows) for _ in range(3))
+    inputs = {
+        "t2m": rng.uniform(253.15, 323.15, n_rows),
+        "d2m": rng.uniform(243.15, 303.15, n_rows),
+        "lcc": lcc,
+        "mcc": mcc,
+        "hcc": rng.uniform(0, 100, n_rows),
+        "tcc": tcc,
+        "vbdsf": rng.uniform(0, 1000, n_rows),
+        "vddsf": rng.uniform(0, 400, n_rows),
+        "u10": rng.uniform(-20, 20, n_rows),
+        "v10": rng.uniform(-20, 20, n_rows),
+    }
+    inputs["t2m"][::97] = np.nan
+    inputs = {name: values.astype(dtype) for name, values in inputs.items()}
+    inputs["solar_geometry"] = utils.SolarGeometry.from_zenith(
+        rng.uniform(0, 90, n_rows), rng.integers(1, 366, n_rows)
+    )
+    return inputs
+
+
+def _fallback(inputs):
+    """calculate_derived_quantities as run without numba"""
+    with mock.patch.object(utils, "numba", None):
+        return utils.calculate_derived_quantities(**inputs, uc=_uc, vc=_vc)
+
+
+@unittest.skipIf(utils.numba is None, "numba is not installed")
+class TestCalculateDerivedQuantities(unittest.TestCase):
+    def assert_paths_agree(self, dtype, rtol):
+        inputs = _inputs(dtype)
+        kernel = utils.calculate_derived_quantities(**inputs, uc=_uc, vc=_vc)
+        fallback = _fallback(inputs)
+
+        self.assertEqual(list(kernel), list(utils._derived_quantities))
+        self.assertEqual(list(fallback), list(utils._derived_quantities))
+        for name in utils._derived_quantities:
+            self.assertEqual(kernel[name].dtype, dtype, name)
+            self.assertEqual(fallback[name].dtype, dtype, name)
+            np.testing.assert_allclose(
+                kernel[name], fallback[name], rtol=rtol, atol=1e-3, err_msg=name
+            )
+
+    def test_float64(self):
+        self.assert_paths_agree(np.float64, rtol=1e-9)
+
+    def test_float32(self):
+        self.assert_paths_agree(np.float32, rtol=1e-4)
+
+    def test_integer_inputs_are_computed_in_float64(self):
+        inputs = _inputs(np.int64)
+        for output in (
+            utils.calculate_derived_quantities(**inputs, uc=_uc, vc=_vc),
+            _fallback(inputs),
+        ):
+            self.assertTrue(all(i.dtype == np.float64 for i in output.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
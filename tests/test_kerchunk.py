@@ -0,0 +1,88 @@
+"""The kerchunk read path of get_grib_data_kerchunk and its fallback to
+get_grib_data when kerchunk is not installed"""
+
+import datetime
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from gnomy import utils
+import helpers
+
+
+class TestKerchunkFallback(unittest.TestCase):
+    def test_missing_kerchunk_falls_back_to_get_grib_data(self):
+        grib_datetimes = [datetime.datetime(2022, 1, 1, i) for i in (3, 4)]
+        with mock.patch.object(utils, "scan_grib", None), mock.patch.object(
+            utils, "get_grib_data", return_value=grib_datetimes[1:]
+        ) as get_grib_data, mock.patch.object(utils, "FastHerbie") as fast_herbie:
+            failed_datetimes = utils.get_grib_data_kerchunk(
+                grib_datetimes,
+                30.0,
+                -98.0,
+                helpers.search_string_0h,
+                helpers.search_string_1h,
+                2,
+                "cache_dir",
+            )
+
+        get_grib_data.assert_called_once_with(
+            grib_datetimes,
+            30.0,
+            -98.0,
+            helpers.search_string_0h,
+            helpers.search_string_1h,
+            2,
+            "cache_dir",
+        )
+        fast_herbie.assert_not_called()
+        self.assertEqual(failed_datetimes, grib_datetimes[1:])
+
+
+@unittest.skipIf(utils.scan_grib is None, "kerchunk is not installed")
+class TestKerchunkRefs(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.grib_datetimes = [datetime.datetime(2022, 1, 1, i) for i in (3, 4, 5)]
+        self.grib_paths = []
+        for grib_datetime in self.grib_datetimes:
+            grib_path = os.path.join(tmp_dir.name, f"{grib_datetime:%H}.grib2")
+            with open(grib_path, "wb") as f:
+                for variable in helpers.variables_0h:
+                    f.write(helpers.grib_message(variable, grib_datetime, 0))
+            self.grib_paths.append(grib_path)
+        patcher = mock.patch.object(
+            utils, "_nearest_grid_index", lambda *args: helpers.grid_index
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_refs_read_the_values_of_every_file(self):
+        refs = utils.build_kerchunk_refs(
+            self.grib_paths,
+            {"typeOfLevel": "heightAboveGround"},
+            remote_protocol="file",
+        )
+        valid_times, values = utils._read_kerchunk_refs_at_location(
+            refs, 30.0, -98.0, remote_protocol="file"
+        )
+
+        self.assertEqual(list(valid_times), self.grib_datetimes)
+        for variable in ("t2m", "d2m"):
+            np.testing.assert_allclose(
+                values[variable],
+                [
+                    helpers.field_values(variable, i, 0)[helpers.grid_index]
+                    for i in self.grib_datetimes
+                ],
+                rtol=1e-5,
+            )
+        self.assertNotIn("sp", values)
+
+
+if __name__ == "__main__":
+    unittest.main()
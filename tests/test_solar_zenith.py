@@ -0,0 +1,77 @@
+"""The analytical solar zenith angle against the SPA, and the per-process memo of
+calculate_solar_zenith_angle"""
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from gnomy import utils
+
+_latitude, _longitude = 29.25, -98.31
+
+
+class TestAnalyticalZenith(unittest.TestCase):
+    def assert_matches_spa(self, index):
+        analytical = utils.calculate_solar_zenith_angle(
+            index, _latitude, _longitude, method="analytical"
+        )
+        spa = utils.calculate_solar_zenith_angle(index, _latitude, _longitude)
+        difference = (analytical - spa).abs()
+        # the closed form solar position is within a degree of the SPA
+        self.assertFalse(difference.isna().any())
+        self.assertLess(difference.max(), 1.0)
+        self.assertLess(difference.mean(), 0.5)
+
+    def test_matches_spa_over_a_year(self):
+        self.assert_matches_spa(pd.date_range("2022-1-1", periods=8760, freq="1h"))
+
+    def test_matches_spa_with_a_local_index(self):
+        self.assert_matches_spa(
+            pd.date_range("2022-6-1", periods=720, freq="1h", tz="America/Chicago")
+        )
+
+    def test_matches_spa_at_15_minutes(self):
+        self.assert_matches_spa(pd.date_range("2022-3-20", periods=96, freq="15min"))
+
+
+class TestZenithMemo(unittest.TestCase):
+    def test_returns_a_fresh_array(self):
+        index = pd.date_range("2021-7-1", periods=48, freq="1h", tz="UTC")
+        first = utils.calculate_solar_zenith_angle(index, _latitude, _longitude)
+        expected = first.to_numpy().copy()
+        first[:] = -1.0
+
+        second = utils.calculate_solar_zenith_angle(index, _latitude, _longitude)
+
+        np.testing.assert_array_equal(second.to_numpy(), expected)
+        self.assertFalse(np.shares_memory(first.to_numpy(), second.to_numpy()))
+        self.assertTrue(second.index.equals(index))
+
+    def test_memo_key_is_the_index(self):
+        index = pd.date_range("2021-8-1", periods=24, freq="1h", tz="UTC")
+        utils._cached_solar_zenith_angle.cache_clear()
+        utils.calculate_solar_zenith_angle(index, _latitude, _longitude)
+        utils.calculate_solar_zenith_angle(index.copy(), _latitude, _longitude)
+        self.assertEqual(utils._cached_solar_zenith_angle.cache_info().hits, 1)
+
+        # another start, length, frequency, tz or location is computed again
+        shifted = utils.calculate_solar_zenith_angle(
+            index + pd.Timedelta("1h"), _latitude, _longitude
+        )
+        local = utils.calculate_solar_zenith_angle(
+            index.tz_convert("America/Chicago"), _latitude, _longitude
+        )
+        self.assertEqual(utils._cached_solar_zenith_angle.cache_info().misses, 3)
+        np.testing.assert_allclose(
+            shifted.to_numpy()[:-1],
+            utils.calculate_solar_zenith_angle(index, _latitude, _longitude)[1:],
+        )
+        np.testing.assert_allclose(
+            local.to_numpy(),
+            utils.calculate_solar_zenith_angle(index, _latitude, _longitude),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
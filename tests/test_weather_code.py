@@ -0,0 +1,69 @@
+"""The lookup table path of parse_weather_code_vec against the scalar
+parse_weather_code"""
+
+import unittest
+
+import numpy as np
+
+from gnomy import utils
+
+# the comparisons of parse_weather_code, the values on both sides of them and NaN
+_thresholds = {
+    "accumulated_precipitation": (0.0, 2.5, 7.6),
+    "pct_frozen_precipitation": (0.0,),
+    "visibility": (0.5, 1.0),
+    "wind_gust_speed": (15.0, 25.7),
+    "smoke": (1e-5, 5e-4),
+}
+_flags = ("freezing_rain", "ice_pellets", "lightning", "rain", "snow")
+
+
+def _random_inputs(rng, n_rows):
+    """inputs of n_rows hours, a mix of threshold values, random values and NaN"""
+    inputs = {}
+    for name, thresholds in _thresholds.items():
+        candidates = np.concatenate(
+            [thresholds, np.nextafter(thresholds, np.inf), [np.nan]]
+        )
+        values = rng.uniform(0, 2 * max(thresholds) + 1, n_rows)
+        on_threshold = rng.random(n_rows) < 0.5
+        values[on_threshold] = rng.choice(candidates, on_threshold.sum())
+        inputs[name] = values
+    for name in _flags:
+        inputs[name] = rng.choice([0.0, 1.0, np.nan], n_rows, p=[0.45, 0.45, 0.1])
+    return inputs
+
+
+class TestParseWeatherCodeVec(unittest.TestCase):
+    def assert_matches_scalar(self, inputs):
+        weather_codes = utils.parse_weather_code_vec(**inputs)
+        n_rows = len(inputs["accumulated_precipitation"])
+        self.assertEqual(weather_codes.shape, (n_rows,))
+        for i in range(n_rows):
+            row = {name: values[i] for name, values in inputs.items()}
+            self.assertEqual(weather_codes[i], utils.parse_weather_code(**row), row)
+
+    def test_matches_scalar_parser_on_random_rows(self):
+        self.assert_matches_scalar(_random_inputs(np.random.default_rng(0), 20000))
+
+    def test_nan_flags_are_truthy(self):
+        inputs = {name: np.zeros(1) for name in _thresholds}
+        inputs["accumulated_precipitation"] = np.array([5.0])
+        inputs |= {name: np.array([np.nan]) for name in _flags}
+        self.assert_matches_scalar(inputs)
+        # lightning, rain, freezing rain, snow and ice pellets are all set
+        self.assertEqual(utils.parse_weather_code_vec(**inputs)[0], "075771991")
+
+    def test_smoke_gate(self):
+        smoke = np.array([0.0, 1e-5, 1e-4, 5e-4, 1e-3, np.nan])
+        inputs = {name: np.zeros(len(smoke)) for name in (*_thresholds, *_flags)}
+        inputs["smoke"] = smoke
+        self.assert_matches_scalar(inputs)
+        self.assertEqual(
+            [i[7] for i in utils.parse_weather_code_vec(**inputs)],
+            ["9", "9", "0", "0", "1", "9"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+"""T_wet_vec against the scalar T_wet, and its numba kernel against the numpy
+fallback"""
+
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from gnomy import utils
+
+
+def _grid():
+    """T_dry (K) and RH (%) over the valid range of T_dry and beyond that of RH"""
+    T_dry, RH = np.meshgrid(np.linspace(253.15, 323.15, 71), np.linspace(0, 110, 56))
+    return T_dry.ravel(), RH.ravel()
+
+
+class TestTWetVec(unittest.TestCase):
+    def test_matches_scalar_t_wet(self):
+        T_dry, RH = _grid()
+        expected = [utils.T_wet(i, j) for i, j in zip(T_dry, RH)]
+        np.testing.assert_allclose(utils.T_wet_vec(T_dry, RH), expected, atol=1e-9)
+
+    def test_nan_inputs_stay_nan(self):
+        # the last hour is inside the valid region of the approximation
+        T_dry = np.array([np.nan, 273.15, np.nan, 273.15])
+        RH = np.array([20.0, np.nan, np.nan, 20.0])
+        for allow_estimation in (True, False):
+            T_wet = utils.T_wet_vec(T_dry, RH, allow_estimation=allow_estimation)
+            np.testing.assert_array_equal(np.isnan(T_wet), [True, True, True, False])
+            self.assertAlmostEqual(T_wet[3], utils.T_wet(273.15, 20.0))
+
+    def test_out_of_range_rh(self):
+        # RH above 99 is clipped, below 5 the dry bulb temperature is the estimate
+        T_wet = utils.T_wet_vec([253.15] * 4, [99.0, 120.0, 2.0, 10.0])
+        self.assertEqual(T_wet[0], T_wet[1])
+        self.assertAlmostEqual(T_wet[2], 253.15)
+        self.assertAlmostEqual(T_wet[3], utils.T_wet(253.15, 10.0))
+        with self.assertRaises(ValueError):
+            utils.T_wet_vec([253.15], [2.0], allow_estimation=False)
+        with self.assertRaises(ValueError):
+            utils.T_wet_vec([213.15], [50.0])
+
+    def test_broadcasts_a_scalar_rh(self):
+        T_dry = np.array([[283.15, 293.15], [303.15, 313.15]])
+        T_wet = utils.T_wet_vec(T_dry, 40.0)
+        self.assertEqual(T_wet.shape, T_dry.shape)
+        np.testing.assert_allclose(
+            T_wet, utils.T_wet_vec(T_dry, np.full((2, 2), 40.0))
+        )
+
+    @unittest.skipIf(utils.numba is None, "numba is not installed")
+    def test_numba_kernel_matches_numpy_fallback(self):
+        T_dry, RH = _grid()
+        T_dry[::7] = np.nan
+        RH[::11] = np.nan
+        T_wet_numba = utils.T_wet_vec(T_dry, RH)
+        with mock.patch.object(utils, "numba", None):
+            T_wet_numpy = utils.T_wet_vec(T_dry, RH)
+        np.testing.assert_allclose(T_wet_numba, T_wet_numpy, atol=1e-9)
+        np.testing.assert_array_equal(np.isnan(T_wet_numba), np.isnan(T_wet_numpy))
+
+
+if __name__ == "__main__":
+    unittest.main()